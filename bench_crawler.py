@@ -0,0 +1,96 @@
+#bench_crawler.py
+"""
+Офлайн-прогон краулера по записанным фикстурам (см. crawler/fixtures.py).
+
+    CRAWL_RECORD_DIR=./fixtures python main.py      # копим корпус на живом трафике
+    python bench_crawler.py ./fixtures              # воспроизводим с исходными задержками
+    python bench_crawler.py ./fixtures --scale 0    # без задержек — чистая скорость краулера
+
+    python bench_crawler.py ./fixtures --engine playwright --concurrency 16
+                                                    # сравнение движков под нагрузкой
+
+Для каждой фикстуры проверяет, что итоговый URL совпал с записанным,
+и печатает время обхода; в конце — сводка: пропускная способность
+и пиковый RSS всего дерева процессов (бенчмарк + браузеры).
+"""
+
+import os
+import sys
+import glob
+import time
+import asyncio
+import argparse
+import statistics
+
+from crawler.fixtures import load_fixture, FixtureReplayer
+from crawler.engines import ENGINES, make_engine
+from crawler.memory import RssSampler
+
+
+async def run(engine, paths: list, scale: float, concurrency: int) -> tuple[list, int]:
+    sem = asyncio.Semaphore(concurrency)
+    timings, failed = [], 0
+
+    async def one(path: str):
+        nonlocal failed
+        fixture = load_fixture(path)
+        replayer = FixtureReplayer(fixture, scale=scale)
+        async with sem:
+            started = time.monotonic()
+            _, final_url, *_ = await engine.fetch(fixture["url"], fixture["device"], replay=replayer)
+            elapsed = time.monotonic() - started
+        timings.append(elapsed)
+
+        ok = final_url == fixture["final_url"]
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {elapsed:6.2f}s  промахов {replayer.misses:3d}  {os.path.basename(path)}")
+        if not ok:
+            print(f"     ожидали: {fixture['final_url']}\n     получили: {final_url}")
+
+    await engine.start()
+    try:
+        await asyncio.gather(*(one(p) for p in paths))
+    finally:
+        await engine.stop()
+    return timings, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк краулера по фикстурам")
+    parser.add_argument("fixtures", help="каталог с *.json.gz или путь к одной фикстуре")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="множитель записанных задержек ответов (0 — без задержек)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="selenium",
+                        help="движок обхода (по умолчанию selenium)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="сколько обходов идёт одновременно")
+    args = parser.parse_args()
+
+    paths = (
+        sorted(glob.glob(os.path.join(args.fixtures, "*.json.gz")))
+        if os.path.isdir(args.fixtures) else [args.fixtures]
+    )
+    if not paths:
+        sys.exit("Фикстуры не найдены")
+
+    # selenium-движок выполняет не больше CRAWL_MAX_SLOTS обходов одновременно (потоки executor'а)
+    engine = make_engine(args.engine)
+    sampler = RssSampler(os.getpid()).start()
+    started = time.monotonic()
+    timings, failed = asyncio.run(run(engine, paths, args.scale, args.concurrency))
+    wall = time.monotonic() - started
+    peak_kb = sampler.stop()["chrome_peak_rss_kb"]
+
+    peak = f"{peak_kb // 1024} МБ" if peak_kb else "—"
+    print(
+        f"\nДвижок: {args.engine}, параллельно {args.concurrency}\n"
+        f"Фикстур: {len(paths)}, расхождений: {failed}; "
+        f"время: медиана {statistics.median(timings):.2f}s, "
+        f"макс {max(timings):.2f}s, всего {wall:.2f}s ({len(paths) / wall:.2f} обходов/с)\n"
+        f"Пиковый RSS: {peak}"
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
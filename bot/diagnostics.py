@@ -0,0 +1,141 @@
+# bot/diagnostics.py
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+
+from config import (
+    DIAG_LAG_INTERVAL,
+    DIAG_LAG_WARN,
+    DIAG_LAG_WINDOW,
+    DIAG_PROFILE_HZ,
+    DIAG_PROFILE_MAX_S,
+)
+
+log = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """
+    Непрерывно меряет задержку event loop: корутина спит DIAG_LAG_INTERVAL
+    и смотрит, насколько позже её разбудили. Параллельно сторожевой поток
+    следит за «сердцебиением» корутины: если loop завис дольше DIAG_LAG_WARN,
+    он пишет в лог стек потока loop — видно, какой синхронный вызов его держит.
+    Накладные расходы — одно пробуждение в DIAG_LAG_INTERVAL.
+    """
+
+    def __init__(self):
+        self.lags = deque(maxlen=DIAG_LAG_WINDOW)   # секунды
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        self._loop_thread_id = threading.get_ident()
+        # отсчёт — с момента запуска: долгий старт бота зависанием не считаем
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._sample(), name="loop-lag")
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + DIAG_LAG_INTERVAL
+            await asyncio.sleep(DIAG_LAG_INTERVAL)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > DIAG_LAG_WARN:
+                log.warning("Event loop отстал на %.3f с", lag)
+
+    def _watchdog(self):
+        reported = 0.0
+        while not self._stop.wait(DIAG_LAG_INTERVAL):
+            stalled = time.monotonic() - self._heartbeat - DIAG_LAG_INTERVAL
+            if stalled <= DIAG_LAG_WARN:
+                reported = 0.0
+                continue
+            if reported:
+                continue  # об этом зависании уже сообщили
+            reported = stalled
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                log.warning(
+                    "Event loop заблокирован %.2f с, стек:\n%s",
+                    stalled, "".join(traceback.format_stack(frame)),
+                )
+
+    def snapshot(self) -> dict:
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+        return {
+            "samples": len(lags),
+            "p50_ms":  lags[len(lags) // 2] * 1000,
+            "p99_ms":  lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+            "max_ms":  self.max_lag * 1000,
+        }
+
+
+def executor_gauge(executor) -> dict:
+    """
+    Занятость ThreadPoolExecutor: потоков создано/максимум и задач в очереди.
+    """
+    if executor is None:
+        return {"threads": 0, "max": 0, "queued": 0}
+    return {
+        "threads": len(executor._threads),
+        "max":     executor._max_workers,
+        "queued":  executor._work_queue.qsize(),
+    }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+def sample_profile(seconds: float) -> str:
+    """
+    Сэмплирующий профиль всего процесса: DIAG_PROFILE_HZ раз в секунду
+    снимает стеки всех потоков через sys._current_frames().
+    Возвращает collapsed stacks («поток;корень;…;лист N» построчно) —
+    формат, который понимают flamegraph.pl, speedscope и inferno.
+    Блокирует вызывающий поток на seconds — запускать через asyncio.to_thread.
+    """
+    seconds = min(seconds, DIAG_PROFILE_MAX_S)
+    interval = 1 / DIAG_PROFILE_HZ
+    me = threading.get_ident()
+    counts = Counter()
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+# Общий экземпляр на процесс
+loop_monitor = LoopLagMonitor()
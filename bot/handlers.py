@@ -1,8 +1,11 @@
 # bot/handlers.py
 
+import os
 import re
 import asyncio
-from functools import partial
+import datetime
+import tempfile
+from functools import partial, wraps
 
 from telegram import (
     Update,
@@ -28,27 +31,95 @@ from db.crud import (
     list_pending_users,        # ← возвращает User.status==pending (с опцией invited_by)
     revoke_invitation,
     get_user_stats,
+    get_global_stats,
     get_random_device,
     create_event,
     create_proxy_log,
+    create_crawl_stat,
+    get_last_resolution,
+    add_watch,
+    count_user_watches,
+    list_user_watches,
+    delete_watch,
 )
-from crawler.redirector import fetch_redirect, ProxyAcquireError
+from crawler.redirector import ProxyAcquireError, ProxyCircuitOpenError, acquire_proxy
+from crawler.engines import crawl_engine
+from crawler.health import proxy_health
+from crawler.concurrency import crawl_controller
 from db.models import UserStatus
+from db.database import unit_of_work, checkpoint
+from db.export import export_events
+from db.urls import normalize_url
+from bot.outbox import outbox, INTERACTIVE, BULK
+from bot.diagnostics import loop_monitor, executor_gauge, sample_profile
+from crawler.redirector import probe_pool
+from crawler.fanout import fetch_redirect_fanout
+from db.devices import DEVICE_CLASSES
+from config import (
+    EXPORT_MAX_BYTES,
+    WATCH_MIN_INTERVAL,
+    WATCH_MAX_PER_USER,
+    FANOUT_MAX_DEVICES,
+    DIAG_PROFILE_MAX_S,
+)
 
 URL_PATTERN = re.compile(r'https?://[^\s)]+')
 
 
+# ——— Сессия БД на апдейт ————————————————————————————
+
+def in_unit_of_work(handler):
+    """
+    Оборачивает хендлер в unit_of_work(): все CRUD-вызовы одного апдейта
+    идут через одну сессию, а записи фиксируются одной транзакцией.
+    """
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        async with unit_of_work():
+            return await handler(update, context)
+    return wrapper
+
+
+# ——— Исходящие сообщения ——————————————————————————————
+
+def reply(update: Update, text: str, priority: int = INTERACTIVE, **kwargs):
+    """
+    Ставит ответ на сообщение апдейта в очередь outbox и сразу возвращается.
+    """
+    return outbox.submit(
+        update.effective_chat.id,
+        partial(update.message.reply_text, text, **kwargs),
+        priority,
+    )
+
+
+def edit(q, text: str, **kwargs):
+    """
+    Правка сообщения с inline-кнопками через outbox;
+    быстрые повторные правки одного сообщения схлопываются.
+    """
+    chat_id, message_id = q.message.chat_id, q.message.message_id
+    return outbox.submit(
+        chat_id,
+        partial(q.edit_message_text, text, **kwargs),
+        INTERACTIVE,
+        coalesce_key=(chat_id, message_id),
+    )
+
+
 # ——— Помощники по меню —————————————————————————————
 
 def build_main_menu(role: str) -> ReplyKeyboardMarkup:
     kb = [["📊 Статистика", "⚙️ Настройки"]]
     if role in ("Maintainer", "Admin"):
         kb.append(["👥 Пользователи", "➕ Добавить пользователя"])
+    if role == "Admin":
+        kb.append(["🌍 Общая статистика"])
     return ReplyKeyboardMarkup(kb, resize_keyboard=True)
 
 
 async def show_main_menu(update: Update, role: str):
-    await update.message.reply_text("🧾 Меню бота", reply_markup=build_main_menu(role))
+    reply(update, "🧾 Меню бота", reply_markup=build_main_menu(role))
 
 
 # ——— /start и /menu ————————————————————————————————
@@ -67,7 +138,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if activated:
         return await show_main_menu(update, role=activated.role)
 
-    await update.message.reply_text(
+    reply(
+        update,
         "❌ У тебя нет доступа. Обратись к администратору.",
         reply_markup=ReplyKeyboardRemove()
     )
@@ -92,7 +164,63 @@ async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• За последний месяц: {st['last_month']}\n"
         f"• За последнюю неделю: {st['last_week']}"
     )
-    await update.message.reply_text(text, reply_markup=build_main_menu(user.role))
+    reply(update, text, reply_markup=build_main_menu(user.role))
+
+
+GLOBAL_STATS_PERIODS = {1: "сутки", 7: "неделю", 30: "месяц"}
+
+
+def _global_stats_keyboard(current: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(("• " if d == current else "") + f"{d} дн.", callback_data=f"gstats_{d}")
+        for d in GLOBAL_STATS_PERIODS
+    ]])
+
+
+async def _global_stats_text(days: int) -> str:
+    st = await get_global_stats(days)
+    rate = f"{st['success'] / st['total']:.0%}" if st["total"] else "—"
+    lines = [
+        f"🌍 Общая статистика за {GLOBAL_STATS_PERIODS[days]}:",
+        f"• Запросов: {st['total']}, успешных: {st['success']} ({rate})",
+        "",
+        "📌 По состояниям:",
+        *(f"  {state}: {n}" for state, n in st["states"]),
+        "",
+        "🔗 Топ итоговых доменов:",
+        *(f"  {host}: {n}" for host, n in st["hosts"]),
+        "",
+        "📡 Топ ISP:",
+        *(f"  {isp}: {n}" for isp, n in st["isps"]),
+    ]
+    return "\n".join(lines)
+
+
+async def global_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active or user.role != "Admin":
+        return
+    reply(
+        update,
+        await _global_stats_text(7),
+        disable_web_page_preview=True,
+        reply_markup=_global_stats_keyboard(7)
+    )
+
+
+async def global_stats_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active or user.role != "Admin":
+        return await q.answer()
+    await q.answer()
+    _, days = q.data.split("_", 1)
+    edit(
+        q,
+        await _global_stats_text(int(days)),
+        disable_web_page_preview=True,
+        reply_markup=_global_stats_keyboard(int(days))
+    )
 
 
 # ——— Список приглашённых (pending) —————————————————————
@@ -110,7 +238,8 @@ async def users_list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     if not pendings:
-        return await update.message.reply_text(
+        return reply(
+            update,
             "Нет активных приглашений.",
             reply_markup=build_main_menu(user.role)
         )
@@ -123,7 +252,8 @@ async def users_list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton(f"@{u.username} {emoji}", callback_data=f"invite_{u.id}")
         ])
 
-    await update.message.reply_text(
+    reply(
+        update,
         "👥 Приглашённые пользователи:",
         reply_markup=InlineKeyboardMarkup(buttons)
     )
@@ -135,7 +265,7 @@ async def invite_detail_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _, uid = q.data.split("_", 1)
     target = await get_user_by_id(int(uid))
     if not target:
-        return await q.edit_message_text("Пользователь не найден.")
+        return edit(q, "Пользователь не найден.")
 
     emoji = {
         "pending":"⏳ Ожидает",
@@ -144,7 +274,7 @@ async def invite_detail_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }[target.status.value]
     text = f"@{target.username}\nСтатус: {emoji}"
     kb = [[InlineKeyboardButton("🗑️ Отозвать приглашение", callback_data=f"revoke_{target.id}")]]
-    await q.edit_message_text(text, reply_markup=InlineKeyboardMarkup(kb))
+    edit(q, text, reply_markup=InlineKeyboardMarkup(kb))
 
 
 async def revoke_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -152,11 +282,377 @@ async def revoke_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     _, uid = q.data.split("_", 1)
     ok = await revoke_invitation(int(uid))
-    await q.edit_message_text(
+    edit(
+        q,
         "✅ Приглашение отозвано." if ok else "❌ Не удалось отозвать."
     )
 
 
+# ——— Здоровье прокси-провайдера ————————————————————————
+
+async def proxy_status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active or user.role not in ("Maintainer", "Admin"):
+        return
+
+    h = proxy_health.snapshot()
+    state = {
+        "closed":    "✅ работает",
+        "open":      "⛔️ отключён (circuit breaker)",
+        "half-open": "⏳ пробный подбор",
+    }[h["state"]]
+    hit_rate = f"{h['hit_rate']:.0%}" if h["hit_rate"] is not None else "—"
+    latency = f"{h['latency_ms']} мс" if h["latency_ms"] is not None else "—"
+    text = (
+        f"🛰 Прокси-провайдер: {state}\n"
+        f"• Попыток в окне: {h['samples']}\n"
+        f"• Доля Москвы: {hit_rate}\n"
+        f"• Медиана проверки: {latency}\n"
+        f"• Бюджет попыток: {h['budget']} (параллельно {h['parallel']})"
+    )
+    if h["retry_in"] is not None:
+        text += f"\n• Пробный подбор через: {h['retry_in']} с"
+    reply(update, text, reply_markup=build_main_menu(user.role))
+
+
+# ——— Диагностика ———————————————————————————————————————
+
+def _ms(value) -> str:
+    return f"{value:.0f} мс" if value is not None else "—"
+
+
+async def diag_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active or user.role != "Admin":
+        return
+
+    lag = loop_monitor.snapshot()
+    slots = crawl_controller.snapshot()
+    crawl_pool = executor_gauge(crawl_controller.executor)
+    probe = executor_gauge(probe_pool)
+    default_pool = executor_gauge(asyncio.get_running_loop()._default_executor)
+    latency = f"{slots['latency_s']:.1f} с" if slots["latency_s"] is not None else "—"
+    load = f"{slots['load_per_cpu']:.2f}" if slots["load_per_cpu"] is not None else "—"
+
+    text = (
+        f"🩺 Диагностика\n"
+        f"⏱ Задержка event loop ({lag['samples']} замеров):\n"
+        f"• p50 {_ms(lag['p50_ms'])}, p99 {_ms(lag['p99_ms'])}, макс {_ms(lag['max_ms'])}\n"
+        f"🧭 Слоты обходов: {slots['active']}/{slots['limit']}, в очереди {slots['waiting']}\n"
+        f"• Обход Chrome ~{latency}, ~{slots['crawl_mb']} МБ\n"
+        f"• Свободно памяти: {slots['available_mb']} МБ, load/CPU: {load}\n"
+        f"🧵 Потоки:\n"
+        f"• обходы {crawl_pool['threads']}/{crawl_pool['max']}, очередь {crawl_pool['queued']}\n"
+        f"• проверка прокси {probe['threads']}/{probe['max']}, очередь {probe['queued']}\n"
+        f"• default {default_pool['threads']}/{default_pool['max']}, очередь {default_pool['queued']}"
+    )
+    reply(update, text, reply_markup=build_main_menu(user.role))
+
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active or user.role != "Admin":
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 10
+    except ValueError:
+        return reply(update, "Использование: /profile [секунды]")
+    seconds = min(max(1, seconds), DIAG_PROFILE_MAX_S)
+
+    reply(update, f"⏳ Снимаю профиль ({seconds} с)…")
+    # сэмплер работает в отдельном потоке и сам не блокирует loop
+    collapsed = await asyncio.to_thread(sample_profile, seconds)
+    outbox.submit(
+        update.effective_chat.id,
+        partial(
+            update.message.reply_document,
+            # bytes, а не файловый объект: при повторе после RetryAfter
+            # прочитанный до конца BytesIO отправился бы пустым
+            document=collapsed.encode("utf-8"),
+            filename=f"profile_{datetime.datetime.utcnow():%Y%m%d_%H%M%S}.collapsed.txt",
+            caption="🔥 Collapsed stacks — flamegraph.pl / speedscope",
+        ),
+        BULK,
+    )
+
+
+# ——— Выгрузка событий ————————————————————————————————
+
+EXPORT_USAGE = (
+    "Использование: /export [csv|jsonl] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] "
+    "[user=ник] [state=success]"
+)
+
+
+def parse_export_args(args: list[str]) -> tuple[str, dict]:
+    """
+    Разбирает аргументы /export в (формат, фильтры для export_events).
+    to= включительно. Бросает ValueError при неверном аргументе.
+    """
+    fmt, export_filters = "csv", {}
+    for arg in args:
+        if arg in ("csv", "jsonl"):
+            fmt = arg
+            continue
+        key, sep, value = arg.partition("=")
+        if not sep or not value:
+            raise ValueError(arg)
+        if key == "from":
+            export_filters["date_from"] = datetime.datetime.strptime(value, "%Y-%m-%d")
+        elif key == "to":
+            export_filters["date_to"] = datetime.datetime.strptime(value, "%Y-%m-%d") + datetime.timedelta(days=1)
+        elif key == "user":
+            export_filters["username"] = value.lstrip("@").lower()
+        elif key == "state":
+            export_filters["state"] = value.replace("_", " ")
+        else:
+            raise ValueError(arg)
+    return fmt, export_filters
+
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active or user.role != "Admin":
+        return
+
+    try:
+        fmt, export_filters = parse_export_args(context.args)
+    except ValueError:
+        return reply(update, EXPORT_USAGE)
+
+    reply(update, "⏳ Готовлю выгрузку…")
+    # выгрузка долгая — не держим соединение апдейта открытым всё это время
+    await checkpoint()
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        total = await export_events(path, fmt, **export_filters)
+        if os.path.getsize(path) > EXPORT_MAX_BYTES:
+            return reply(
+                update,
+                "❗ Файл слишком большой для Telegram — сузь период или добавь фильтры."
+            )
+        async def send_export():
+            # файл открываем на каждую попытку: повтор после RetryAfter
+            # иначе читал бы его с конца и отправил пустым
+            with open(path, "rb") as f:
+                return await update.message.reply_document(
+                    document=f,
+                    filename=f"events_{datetime.date.today():%Y%m%d}.{fmt}.gz",
+                    caption=f"📦 Событий: {total}",
+                )
+
+        # ждём отправки: файл удаляется сразу после неё
+        await outbox.submit(update.effective_chat.id, send_export, BULK)
+    finally:
+        os.remove(path)
+
+
+# ——— Списки наблюдения ————————————————————————————————
+
+WATCH_USAGE = (
+    "Использование: /watch <ссылка> <интервал: 30m, 6h, 1d> [ios|android|desktop]"
+)
+
+_INTERVAL_UNITS = {"m": 1, "h": 60, "d": 24 * 60}
+
+
+def parse_interval(value: str) -> int:
+    """
+    "30m" / "6h" / "1d" → минуты (число без суффикса — часы).
+    Бросает ValueError при неверном формате.
+    """
+    value = value.strip().lower()
+    if value[-1:] in _INTERVAL_UNITS:
+        value, unit = value[:-1], value[-1]
+    else:
+        unit = "h"
+    amount = int(value)
+    if amount <= 0:
+        raise ValueError(value)
+    return amount * _INTERVAL_UNITS[unit]
+
+
+def _interval_text(minutes: int) -> str:
+    for unit, size in (("d", 24 * 60), ("h", 60)):
+        if minutes % size == 0:
+            return f"{minutes // size}{unit}"
+    return f"{minutes}m"
+
+
+async def watch_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active:
+        return
+
+    args = context.args
+    if len(args) not in (2, 3) or not URL_PATTERN.match(args[0]):
+        return reply(update, WATCH_USAGE)
+    try:
+        interval = parse_interval(args[1])
+    except ValueError:
+        return reply(update, WATCH_USAGE)
+    device_class = args[2].lower() if len(args) == 3 else None
+    if device_class is not None and device_class not in DEVICE_CLASSES:
+        return reply(update, WATCH_USAGE)
+
+    if interval < WATCH_MIN_INTERVAL:
+        return reply(update, f"❗ Интервал не меньше {_interval_text(WATCH_MIN_INTERVAL)}.")
+    if await count_user_watches(user.id) >= WATCH_MAX_PER_USER:
+        return reply(update, f"❗ Можно отслеживать не больше {WATCH_MAX_PER_USER} ссылок.")
+
+    item = await add_watch(user.id, args[0], interval, device_class)
+    reply(
+        update,
+        f"👁 Ссылка #{item.id} добавлена: проверка раз в {_interval_text(interval)}"
+        f" ({device_class or 'любое устройство'}). Сообщу, если итоговый адрес изменится."
+    )
+
+
+async def watches_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active:
+        return
+
+    items = await list_user_watches(user.id)
+    if not items:
+        return reply(update, "Список наблюдения пуст. Добавить: " + WATCH_USAGE.split(": ", 1)[1])
+
+    lines, buttons = ["👁 Отслеживаемые ссылки:"], []
+    for w in items:
+        lines.append(
+            f"#{w['id']} {w['url']}\n"
+            f"   раз в {_interval_text(w['interval_minutes'])}, {w['device_class'] or 'любое устройство'}, "
+            f"след. проверка {w['next_check_at']:%d.%m %H:%M} UTC"
+        )
+        buttons.append([InlineKeyboardButton(f"🗑 #{w['id']}", callback_data=f"unwatch_{w['id']}")])
+
+    reply(
+        update,
+        "\n".join(lines),
+        reply_markup=InlineKeyboardMarkup(buttons),
+        disable_web_page_preview=True
+    )
+
+
+async def unwatch_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user:
+        return
+    _, wid = q.data.split("_", 1)
+    ok = await delete_watch(int(wid), user.id)
+    edit(
+        q,
+        f"✅ Ссылка #{wid} больше не отслеживается." if ok else "❌ Не удалось удалить."
+    )
+
+
+# ——— Сравнение по устройствам ——————————————————————————
+
+COMPARE_USAGE = (
+    "Использование: /compare <ссылка> [ios|android|desktop …] — "
+    "без классов берётся по одному профилю каждого"
+)
+
+
+def _compare_report(initial_url: str, ip, isp, labeled: list, runs: list) -> str:
+    """
+    Группирует профили по итоговому URL: одинаковые итоги — одной строкой.
+    """
+    groups, failed = {}, []
+    for (label, device), run in zip(labeled, runs):
+        name = f"{label}: {device['model']}"
+        if isinstance(run, BaseException):
+            failed.append(name)
+        else:
+            groups.setdefault(run[1], []).append(name)
+
+    lines = [f"🔀 Сравнение по устройствам\n🔗 {initial_url}"]
+    if len(groups) == 1:
+        lines.append("✅ Итог одинаковый на всех устройствах")
+    for i, (final_url, names) in enumerate(groups.items(), 1):
+        lines.append(f"✅ Итог {i}:\n{final_url}\n   📱 " + ", ".join(names))
+    if failed:
+        lines.append("❌ Не удалось обойти: " + ", ".join(failed))
+    lines.append(f"🌐 IP: {ip}\n📡 ISP: {isp}")
+    return "\n".join(lines)
+
+
+async def compare_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_user_by_tg(update.effective_user.id)
+    if not user or user.status is not UserStatus.active:
+        return
+
+    args = context.args
+    if not args or not URL_PATTERN.match(args[0]):
+        return reply(update, COMPARE_USAGE)
+    classes = [a.lower() for a in args[1:]]
+    if any(c not in DEVICE_CLASSES for c in classes):
+        return reply(update, COMPARE_USAGE)
+    if len(classes) > FANOUT_MAX_DEVICES:
+        return reply(update, f"❗ Не больше {FANOUT_MAX_DEVICES} профилей за раз.")
+
+    # без явного списка — по одному профилю каждого класса (пустые классы пропускаем)
+    labeled = []
+    for cls in classes or DEVICE_CLASSES:
+        try:
+            labeled.append((cls, await get_random_device(cls)))
+        except ValueError as e:
+            if classes:
+                return reply(update, str(e))
+    if not labeled:
+        return reply(update, "❗ В базе нет включённых профилей устройств.")
+
+    raw_url = args[0]
+    reply(update, f"⏳ Обхожу на {len(labeled)} устройствах…")
+
+    # не держим соединение с БД, пока идут обходы
+    await checkpoint()
+
+    async def proxy_failed(state: str):
+        # как в handle_message: отказ провайдера попадает в статистику — по событию на профиль
+        for _, device in labeled:
+            await create_event(user_id=user.id, state=state,
+                               device_option_id=device["id"], initial_url=raw_url,
+                               final_url="", ip=None, isp=None)
+
+    try:
+        ip, isp, proxy_attempts, runs = await fetch_redirect_fanout(raw_url, [d for _, d in labeled])
+    except ProxyCircuitOpenError:
+        await proxy_failed("proxy circuit open")
+        return reply(update, "⚠️ Прокси-провайдер сейчас недоступен, попробуй через пару минут.")
+    except ProxyAcquireError as e:
+        for at in e.attempts:
+            await create_proxy_log(at["attempt"], at["ip"], at["city"], at["latency_ms"])
+        await proxy_failed("proxy error")
+        return reply(update, f"⚠️ Не удалось подобрать прокси за {len(e.attempts)} попыток.")
+
+    for at in proxy_attempts:
+        await create_proxy_log(at["attempt"], at["ip"], at["city"], at["latency_ms"])
+
+    initial_url = raw_url  # если все обходы упали — показываем ссылку как есть
+    for (_, device), run in zip(labeled, runs):
+        if isinstance(run, BaseException):
+            await create_event(user_id=user.id, state="crawl error",
+                               device_option_id=device["id"], initial_url=raw_url,
+                               final_url="", ip=ip, isp=isp)
+            continue
+        initial_url, final_url, crawl_stats = run
+        crawl_controller.observe(crawl_stats)
+        ev = await create_event(user_id=user.id, state="success",
+                                device_option_id=device["id"],
+                                initial_url=initial_url, final_url=final_url,
+                                ip=ip, isp=isp)
+        await create_crawl_stat(ev.id, crawl_stats)
+
+    reply(update, _compare_report(initial_url, ip, isp, labeled, runs),
+          priority=BULK,
+          disable_web_page_preview=True)
+
+
 # ——— Режим «Добавить пользователя» ————————————————————
 
 async def start_add_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -164,7 +660,8 @@ async def start_add_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user or user.status is not UserStatus.active or user.role not in ("Maintainer","Admin"):
         return
     context.user_data["awaiting_new_username"] = True
-    await update.message.reply_text(
+    reply(
+        update,
         "Введите ник нового пользователя (без @):",
         reply_markup=ReplyKeyboardRemove()
     )
@@ -192,7 +689,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.pop("awaiting_new_username", False):
         uname = text.lstrip("@").lower()
         new = await invite_user(username=uname, role="User", invited_by=tg_id)
-        return await update.message.reply_text(
+        return reply(
+            update,
             f"@{new.username} приглашён. Статус: ⏳",
             reply_markup=build_main_menu(user.role)
         )
@@ -202,6 +700,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await menu(update, context)
     if text == "📊 Статистика":
         return await stats_cmd(update, context)
+    if text == "🌍 Общая статистика":
+        return await global_stats_cmd(update, context)
     if text == "👥 Пользователи":
         return await users_list_cmd(update, context)
     if text == "➕ Добавить пользователя":
@@ -216,45 +716,66 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await create_event(user_id=user.id, state="no link",
                            device_option_id=0, initial_url="", final_url="",
                            ip=None, isp=None)
-        return await update.message.reply_text("❗ Пожалуйста, пришли одну ссылку.",
-                                               reply_to_message_id=update.message.message_id)
+        return reply(update, "❗ Пожалуйста, пришли одну ссылку.",
+                     reply_to_message_id=update.message.message_id)
     if len(urls) > 1:
         await create_event(user_id=user.id, state="many links",
                            device_option_id=0, initial_url="", final_url="",
                            ip=None, isp=None)
-        return await update.message.reply_text("❗ Одну ссылку за раз, пожалуйста.",
-                                               reply_to_message_id=update.message.message_id)
+        return reply(update, "❗ Одну ссылку за раз, пожалуйста.",
+                     reply_to_message_id=update.message.message_id)
 
     raw_url = urls[0]
     try:
         device = await get_random_device()
     except ValueError as e:
-        return await update.message.reply_text(str(e),
-                                               reply_to_message_id=update.message.message_id)
+        return reply(update, str(e),
+                     reply_to_message_id=update.message.message_id)
+
+    # не держим соединение с БД, пока идёт обход
+    await checkpoint()
 
     loop = asyncio.get_running_loop()
     try:
-        initial_url, final_url, ip, isp, _, proxy_attempts = await loop.run_in_executor(
-            None, partial(fetch_redirect, raw_url, device)
+        # подбор прокси не запускает Chrome, поэтому слот обхода под него не берём
+        proxy, proxy_attempts = await loop.run_in_executor(None, acquire_proxy)
+        # слот обхода: число одновременных Chrome подстраивается под память и CPU хоста
+        async with crawl_controller.slot():
+            initial_url, final_url, ip, isp, _, _, crawl_stats = await crawl_engine.fetch(
+                raw_url, device, proxy=proxy
+            )
+    except ProxyCircuitOpenError:
+        await create_event(user_id=user.id, state="proxy circuit open",
+                           device_option_id=device["id"], initial_url=raw_url,
+                           final_url="", ip=None, isp=None)
+        return reply(
+            update,
+            "⚠️ Прокси-провайдер сейчас недоступен, попробуй через пару минут.",
+            reply_to_message_id=update.message.message_id
         )
     except ProxyAcquireError as e:
         for at in e.attempts:
-            await create_proxy_log(at["attempt"], at["ip"], at["city"])
+            await create_proxy_log(at["attempt"], at["ip"], at["city"], at["latency_ms"])
         await create_event(user_id=user.id, state="proxy error",
                            device_option_id=device["id"], initial_url=raw_url,
                            final_url="", ip=None, isp=None)
-        return await update.message.reply_text(
+        return reply(
+            update,
             f"⚠️ Не удалось подобрать прокси за {len(e.attempts)} попыток.",
             reply_to_message_id=update.message.message_id
         )
 
+    crawl_controller.observe(crawl_stats)
     for at in proxy_attempts:
-        await create_proxy_log(at["attempt"], at["ip"], at["city"])
+        await create_proxy_log(at["attempt"], at["ip"], at["city"], at["latency_ms"])
+
+    previous = await get_last_resolution(initial_url)
 
-    await create_event(user_id=user.id, state="success",
-                       device_option_id=device["id"],
-                       initial_url=initial_url, final_url=final_url,
-                       ip=ip, isp=isp)
+    ev = await create_event(user_id=user.id, state="success",
+                            device_option_id=device["id"],
+                            initial_url=initial_url, final_url=final_url,
+                            ip=ip, isp=isp)
+    await create_crawl_stat(ev.id, crawl_stats)
 
     report = (
         f"📱 Профиль: {device['model']}\n"
@@ -264,14 +785,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🌐 IP: {ip}\n"
         f"📡 ISP: {isp}"
     )
-    await update.message.reply_text(report,
-                                    disable_web_page_preview=True,
-                                    reply_to_message_id=update.message.message_id)
+    if previous and previous["final_url"] != normalize_url(final_url):
+        report += (
+            f"\n🕘 В прошлый раз ({previous['timestamp']:%d.%m.%Y}) вела на:\n"
+            f"{previous['final_url']}"
+        )
+    reply(update, report,
+          priority=BULK,
+          disable_web_page_preview=True,
+          reply_to_message_id=update.message.message_id)
 
 
 def register_handlers(app: Application):
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("menu", menu))
-    app.add_handler(CallbackQueryHandler(invite_detail_cb, pattern=r"^invite_\d+$"))
-    app.add_handler(CallbackQueryHandler(revoke_cb,       pattern=r"^revoke_\d+$"))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(CommandHandler("start", in_unit_of_work(start)))
+    app.add_handler(CommandHandler("menu", in_unit_of_work(menu)))
+    app.add_handler(CommandHandler("proxy_status", in_unit_of_work(proxy_status_cmd)))
+    app.add_handler(CommandHandler("export", in_unit_of_work(export_cmd)))
+    app.add_handler(CommandHandler("diag", in_unit_of_work(diag_cmd)))
+    app.add_handler(CommandHandler("watch", in_unit_of_work(watch_cmd)))
+    app.add_handler(CommandHandler("watches", in_unit_of_work(watches_cmd)))
+    app.add_handler(CommandHandler("compare", in_unit_of_work(compare_cmd)))
+    # профиль может длиться минуту — соединение с БД на это время не держим,
+    # а block=False не даёт ему задерживать другие апдейты, которые он и должен снять
+    app.add_handler(CommandHandler("profile", profile_cmd, block=False))
+    app.add_handler(CallbackQueryHandler(in_unit_of_work(invite_detail_cb), pattern=r"^invite_\d+$"))
+    app.add_handler(CallbackQueryHandler(in_unit_of_work(revoke_cb),       pattern=r"^revoke_\d+$"))
+    app.add_handler(CallbackQueryHandler(in_unit_of_work(global_stats_cb), pattern=r"^gstats_(1|7|30)$"))
+    app.add_handler(CallbackQueryHandler(in_unit_of_work(unwatch_cb),      pattern=r"^unwatch_\d+$"))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, in_unit_of_work(handle_message)))
@@ -0,0 +1,224 @@
+# bot/outbox.py
+
+import time
+import asyncio
+import logging
+import itertools
+
+from telegram.error import RetryAfter
+
+from config import (
+    OUTBOX_GLOBAL_RATE,
+    OUTBOX_CHAT_RATE,
+    OUTBOX_GROUP_RATE,
+    OUTBOX_CHAT_BURST,
+)
+
+log = logging.getLogger(__name__)
+
+# Приоритеты: меньше — раньше
+INTERACTIVE = 0   # меню, ответы на кнопки, короткие подсказки
+BULK        = 1   # результаты обходов, выгрузки, уведомления
+
+
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, не больше capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0   # пауза после RetryAfter
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Через сколько секунд появится токен (0 — уже есть).
+        """
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "key", "factory", "futures")
+
+    def __init__(self, priority, seq, chat_id, key, factory, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.key = key
+        self.factory = factory
+        self.futures = [future]
+
+
+class Outbox:
+    """
+    Единая очередь исходящих сообщений Telegram.
+
+    • token bucket на весь бот и на каждый чат (для групп — строже);
+    • RetryAfter ставит чат на паузу на указанное время, сообщение
+      остаётся первым в очереди этого чата;
+    • сообщения одного чата уходят строго по порядку, разные чаты — параллельно;
+    • приоритет действует между чатами: чат, где ждёт INTERACTIVE,
+      обслуживается раньше чатов только с BULK;
+    • задания с одинаковым coalesce_key (правки одного сообщения),
+      ещё не отправленные, схлопываются — уйдёт только последняя версия.
+
+    Хендлеры вызывают submit() и не ждут отправки; при необходимости
+    можно дождаться возвращённого future.
+    """
+
+    def __init__(self):
+        self._jobs = []                 # ожидающие задания
+        self._by_key = {}               # coalesce_key → _Job
+        self._busy = set()              # чаты, в которые идёт отправка
+        self._buckets = {}              # chat_id → TokenBucket
+        self._global = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._sending = set()           # задания, которые сейчас отправляются
+        self._task = None
+
+    # ——— Жизненный цикл (post_init / post_shutdown приложения) ————————
+
+    async def start(self, app=None):
+        self._task = asyncio.create_task(self._dispatch(), name="outbox")
+
+    async def stop(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # ждущие submit() не должны зависнуть навсегда
+        for job in [*self._jobs, *self._sending]:
+            for f in job.futures:
+                f.cancel()
+        self._jobs.clear()
+        self._by_key.clear()
+
+    # ——— Постановка в очередь —————————————————————————————
+
+    def submit(self, chat_id: int, factory, priority: int = INTERACTIVE, coalesce_key=None) -> asyncio.Future:
+        """
+        Ставит отправку в очередь. factory — функция без аргументов,
+        возвращающая корутину вызова Bot API (например, partial(message.reply_text, text)).
+        Возвращает future с результатом вызова.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # никто может не ждать результата — не шумим «exception was never retrieved»
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        if coalesce_key is not None and coalesce_key in self._by_key:
+            job = self._by_key[coalesce_key]
+            job.factory = factory
+            job.priority = min(job.priority, priority)
+            job.futures.append(future)
+        else:
+            job = _Job(priority, next(self._seq), chat_id, coalesce_key, factory, future)
+            self._jobs.append(job)
+            if coalesce_key is not None:
+                self._by_key[coalesce_key] = job
+
+        self._wakeup.set()
+        return future
+
+    # ——— Диспетчер ————————————————————————————————————————
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = OUTBOX_GROUP_RATE if chat_id < 0 else OUTBOX_CHAT_RATE
+            bucket = self._buckets[chat_id] = TokenBucket(rate, OUTBOX_CHAT_BURST)
+        return bucket
+
+    def _pick(self, now: float):
+        """
+        Возвращает (задание, 0) или (None, через сколько секунд проверить снова).
+        """
+        global_delay = self._global.delay(now)
+        next_check = None
+
+        # кандидат от каждого чата — только самое раннее его задание (FIFO),
+        # а приоритет чата — самый высокий среди его ожидающих заданий
+        heads, chat_priority = {}, {}
+        for job in self._jobs:
+            head = heads.get(job.chat_id)
+            if head is None or job.seq < head.seq:
+                heads[job.chat_id] = job
+            chat_priority[job.chat_id] = min(chat_priority.get(job.chat_id, job.priority), job.priority)
+
+        for job in sorted(heads.values(), key=lambda j: (chat_priority[j.chat_id], j.seq)):
+            if job.chat_id in self._busy:
+                continue
+            delay = max(global_delay, self._bucket(job.chat_id).delay(now))
+            if delay <= 0:
+                return job, 0
+            next_check = delay if next_check is None else min(next_check, delay)
+        return None, next_check
+
+    async def _dispatch(self):
+        while True:
+            job, wait = self._pick(time.monotonic())
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._jobs.remove(job)
+            if job.key is not None:
+                self._by_key.pop(job.key, None)
+            self._global.take()
+            self._bucket(job.chat_id).take()
+            self._busy.add(job.chat_id)
+            self._sending.add(job)
+            asyncio.create_task(self._send(job))
+
+    async def _send(self, job: _Job):
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+            log.warning("Flood control в чате %s: пауза %.1f с", job.chat_id, retry_after)
+            self._bucket(job.chat_id).blocked_until = time.monotonic() + retry_after
+            # возвращаем задание в очередь с прежним местом
+            if job.key is not None and job.key in self._by_key:
+                # пока ждали, пришла более свежая правка — отдаём её результат и этим
+                self._by_key[job.key].futures.extend(job.futures)
+            else:
+                self._jobs.append(job)
+                if job.key is not None:
+                    self._by_key[job.key] = job
+        except Exception as e:
+            log.exception("Не удалось отправить сообщение в чат %s", job.chat_id)
+            for f in job.futures:
+                if not f.done():
+                    f.set_exception(e)
+        else:
+            for f in job.futures:
+                if not f.done():
+                    f.set_result(result)
+        finally:
+            self._sending.discard(job)
+            self._busy.discard(job.chat_id)
+            self._wakeup.set()
+
+
+# Общий экземпляр на процесс
+outbox = Outbox()
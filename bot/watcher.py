@@ -0,0 +1,175 @@
+# bot/watcher.py
+
+import asyncio
+import logging
+import datetime
+from functools import partial
+from collections import defaultdict
+
+from config import (
+    WATCH_TICK,
+    WATCH_WINDOWS,
+    WATCH_BATCH_SIZE,
+    WATCH_SESSION_SIZE,
+    WATCH_RETRY_DELAY,
+)
+from db.database import unit_of_work
+from db.crud import (
+    get_random_device,
+    get_last_resolution,
+    list_due_watches,
+    reschedule_watch,
+    create_event,
+    create_proxy_log,
+    create_crawl_stat,
+)
+from db.urls import normalize_url
+from crawler.redirector import ProxyAcquireError, acquire_proxy
+from crawler.engines import crawl_engine
+from crawler.concurrency import crawl_controller
+from bot.outbox import outbox, BULK
+
+log = logging.getLogger(__name__)
+
+
+def parse_windows(raw: str) -> list:
+    """
+    "01:00-07:00,13:00-14:00" → [(time(1), time(7)), (time(13), time(14))].
+    Окно может переходить через полночь: "23:00-05:00".
+    """
+    windows = []
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        start, end = (datetime.time.fromisoformat(t.strip()) for t in part.split("-"))
+        windows.append((start, end))
+    return windows
+
+
+def in_windows(now: datetime.time, windows: list) -> bool:
+    if not windows:
+        return True
+    for start, end in windows:
+        if start <= end and start <= now < end:
+            return True
+        if start > end and (now >= start or now < end):
+            return True
+    return False
+
+
+class WatchScheduler:
+    """
+    Фоновые перепроверки ссылок из списков наблюдения.
+
+    Раз в WATCH_TICK секунд (только в окнах WATCH_WINDOWS) берёт до
+    WATCH_BATCH_SIZE подошедших проверок, группирует их по классу устройства
+    и обходит пачками по WATCH_SESSION_SIZE: один прокси и один браузер на пачку.
+    Обходы идут через фоновые слоты crawl_controller и не отнимают
+    ресурсы у интерактивных запросов. Пользователь получает уведомление,
+    только если итоговый URL изменился относительно его прошлого события.
+    """
+
+    def __init__(self):
+        self.windows = parse_windows(WATCH_WINDOWS)
+        self._bot = None
+        self._task = None
+
+    async def start(self, app):
+        self._bot = app.bot
+        self._task = asyncio.create_task(self._run(), name="watch-scheduler")
+
+    async def stop(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if in_windows(datetime.datetime.now().time(), self.windows):
+                    await self.run_due()
+            except Exception:
+                log.exception("Ошибка планировщика списков наблюдения")
+            await asyncio.sleep(WATCH_TICK)
+
+    async def run_due(self):
+        async with unit_of_work():
+            due = await list_due_watches(datetime.datetime.utcnow(), WATCH_BATCH_SIZE)
+
+        groups = defaultdict(list)
+        for item in due:
+            groups[item["device_class"]].append(item)
+
+        await asyncio.gather(*(
+            self._check_session(device_class, items[i:i + WATCH_SESSION_SIZE])
+            for device_class, items in groups.items()
+            for i in range(0, len(items), WATCH_SESSION_SIZE)
+        ))
+
+    async def _retry_later(self, items: list):
+        retry_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=WATCH_RETRY_DELAY)
+        async with unit_of_work():
+            for item in items:
+                await reschedule_watch(item["id"], retry_at)
+
+    async def _check_session(self, device_class, items: list):
+        """
+        Одна сессия: общий профиль, прокси и Chrome для всех items.
+        """
+        try:
+            async with unit_of_work():
+                device = await get_random_device(device_class)
+        except ValueError:
+            log.warning("Нет профилей класса %s для списков наблюдения", device_class)
+            return await self._retry_later(items)
+
+        loop = asyncio.get_running_loop()
+        try:
+            # подбор прокси не запускает Chrome, поэтому слот обхода под него не берём
+            proxy, proxy_attempts = await loop.run_in_executor(None, acquire_proxy)
+            async with crawl_controller.slot(background=True):
+                ip, isp, _, results = await crawl_engine.fetch_many(
+                    [item["url"] for item in items], device, proxy=proxy
+                )
+        except ProxyAcquireError as e:
+            async with unit_of_work():
+                for at in e.attempts:
+                    await create_proxy_log(at["attempt"], at["ip"], at["city"], at["latency_ms"])
+            return await self._retry_later(items)
+        except Exception:
+            log.exception("Не удалось выполнить фоновую проверку")
+            return await self._retry_later(items)
+
+        now = datetime.datetime.utcnow()
+        async with unit_of_work():
+            for at in proxy_attempts:
+                await create_proxy_log(at["attempt"], at["ip"], at["city"], at["latency_ms"])
+
+            for item, (initial_url, final_url, crawl_stats) in zip(items, results):
+                crawl_controller.observe(crawl_stats)
+                previous = await get_last_resolution(initial_url, user_id=item["user_id"])
+                ev = await create_event(user_id=item["user_id"], state="watch",
+                                        device_option_id=device["id"],
+                                        initial_url=initial_url, final_url=final_url,
+                                        ip=ip, isp=isp)
+                await create_crawl_stat(ev.id, crawl_stats)
+                await reschedule_watch(item["id"], now + datetime.timedelta(minutes=item["interval_minutes"]))
+
+                if previous and previous["final_url"] != normalize_url(final_url):
+                    self._notify(item, previous["final_url"], final_url, device)
+
+    def _notify(self, item: dict, old_url: str, new_url: str, device: dict):
+        text = (
+            f"🔔 Ссылка #{item['id']} теперь ведёт в другое место\n"
+            f"🔗 {item['url']}\n"
+            f"❌ Было:\n{old_url}\n"
+            f"✅ Стало:\n{new_url}\n"
+            f"📱 Профиль: {device['model']}"
+        )
+        outbox.submit(
+            item["tg_id"],
+            partial(self._bot.send_message, item["tg_id"], text, disable_web_page_preview=True),
+            BULK,
+        )
+
+
+# Общий экземпляр на процесс
+watch_scheduler = WatchScheduler()
@@ -35,9 +35,148 @@ PROXY_DNS      = os.getenv("PROXY_DNS", "165.154.179.147:2334")
 # URL для определения ISP/IP по IP-адресу
 IP_API_URL = os.getenv("IP_API_URL", "http://ip-api.com/json")
 
+# Минимальный IP-echo: через прокси узнаём только внешний IP (plain text)
+IP_ECHO_URL = os.getenv("IP_ECHO_URL", "https://api.ipify.org")
+
+# Локальные GeoIP-базы в формате MaxMind (.mmdb).
+# City-база даёт город, ASN/ISP-база — провайдера. Пустой путь — база не используется.
+GEOIP_CITY_DB = os.getenv("GEOIP_CITY_DB", "./geoip/GeoLite2-City.mmdb")
+GEOIP_ASN_DB  = os.getenv("GEOIP_ASN_DB", "./geoip/GeoLite2-ASN.mmdb")
+# Сколько exit-IP держим в кэше результатов
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "4096"))
+
+# Запасной вариант: если локальной базы нет или IP в ней не найден — идём в ip-api
+IP_API_FALLBACK = os.getenv("IP_API_FALLBACK", "1") == "1"
+
 # ======================
 # Timing & Retry Limits
 # ======================
 CHECK_INTERVAL     = int(os.getenv("CHECK_INTERVAL", "1"))
 REDIRECT_TIMEOUT   = int(os.getenv("REDIRECT_TIMEOUT", "20"))
 MAX_PROXY_ATTEMPTS = int(os.getenv("MAX_PROXY_ATTEMPTS", "5"))
+
+# ======================
+# Proxy Health / Circuit Breaker
+# ======================
+# Окно (в секундах), по которому считаем долю «московских» IP и задержку проверки
+PROXY_HEALTH_WINDOW      = int(os.getenv("PROXY_HEALTH_WINDOW", "900"))
+# Желаемая вероятность найти московский прокси в пределах бюджета попыток
+PROXY_TARGET_SUCCESS     = float(os.getenv("PROXY_TARGET_SUCCESS", "0.95"))
+# Границы адаптивного бюджета попыток (без данных используется MAX_PROXY_ATTEMPTS)
+PROXY_MIN_ATTEMPTS       = int(os.getenv("PROXY_MIN_ATTEMPTS", "2"))
+PROXY_MAX_ATTEMPTS_CAP   = int(os.getenv("PROXY_MAX_ATTEMPTS_CAP", "12"))
+# Сколько прокси-кандидатов проверяем одновременно (максимум)
+PROXY_MAX_PARALLEL       = int(os.getenv("PROXY_MAX_PARALLEL", "4"))
+# Circuit breaker: открывается, если в окне >= MIN_SAMPLES попыток и доля попаданий ниже порога
+PROXY_BREAKER_MIN_SAMPLES  = int(os.getenv("PROXY_BREAKER_MIN_SAMPLES", "20"))
+PROXY_BREAKER_MIN_HIT_RATE = float(os.getenv("PROXY_BREAKER_MIN_HIT_RATE", "0.05"))
+# Через сколько секунд открытый breaker пропускает пробный запрос
+PROXY_BREAKER_COOLDOWN     = int(os.getenv("PROXY_BREAKER_COOLDOWN", "120"))
+
+# ======================
+# Crawl Capture & Memory Accounting
+# ======================
+# Сколько document/redirect-переходов максимум сохраняем за один обход
+CAPTURE_MAX_HOPS = int(os.getenv("CAPTURE_MAX_HOPS", "50"))
+# Период опроса RSS Chrome и процесса бота во время обхода (секунды)
+RSS_SAMPLE_INTERVAL = float(os.getenv("RSS_SAMPLE_INTERVAL", "0.5"))
+
+# ======================
+# Crawl Engine
+# ======================
+# Чем обходим ссылки:
+#   selenium   — отдельный Chrome + selenium-wire на каждый обход (в потоке executor'а);
+#   playwright — один долгоживущий Chromium, на обход — изолированный контекст (asyncio).
+CRAWL_ENGINE = os.getenv("CRAWL_ENGINE", "selenium").lower()
+_LIGHT_ENGINE = CRAWL_ENGINE == "playwright"
+
+# ======================
+# Crawl Concurrency (AIMD)
+# ======================
+# Границы числа одновременных обходов (Chrome-сессий или контекстов) и стартовое значение
+CRAWL_MIN_SLOTS     = int(os.getenv("CRAWL_MIN_SLOTS", "1"))
+CRAWL_MAX_SLOTS     = int(os.getenv("CRAWL_MAX_SLOTS", "64" if _LIGHT_ENGINE else "16"))
+CRAWL_INITIAL_SLOTS = int(os.getenv("CRAWL_INITIAL_SLOTS", "2"))
+# Сколько памяти (МБ) должно оставаться свободным после запуска ещё одного Chrome
+CRAWL_MIN_FREE_MB   = int(os.getenv("CRAWL_MIN_FREE_MB", "512"))
+# Оценка памяти одного обхода до появления реальных замеров (МБ)
+# (контекст общего Chromium заметно легче отдельного Chrome)
+CRAWL_EXPECTED_MB   = int(os.getenv("CRAWL_EXPECTED_MB", "80" if _LIGHT_ENGINE else "400"))
+# Максимальная load average в пересчёте на одно ядро
+CRAWL_MAX_LOAD      = float(os.getenv("CRAWL_MAX_LOAD", "1.5"))
+# Если сглаженная длительность обхода выше — уменьшаем число слотов (секунды)
+CRAWL_TARGET_LATENCY = float(os.getenv("CRAWL_TARGET_LATENCY", "45"))
+# Не уменьшаем лимит чаще, чем раз в столько секунд
+CRAWL_DECREASE_COOLDOWN = float(os.getenv("CRAWL_DECREASE_COOLDOWN", "15"))
+# Как часто перепроверяем хост, пока приём новых обходов приостановлен (секунды)
+CRAWL_ADMISSION_POLL = float(os.getenv("CRAWL_ADMISSION_POLL", "1"))
+
+# ======================
+# Events Export
+# ======================
+# Сколько строк за раз читаем из БД при выгрузке
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+# Лимит Telegram Bot API на отправку файла
+EXPORT_MAX_BYTES  = int(os.getenv("EXPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# ======================
+# URL Dictionary
+# ======================
+# Сколько пар hash→id держим в LRU-кэше интернированных URL
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", "10000"))
+# Размер пачки событий при переносе старых URL в словарь
+URL_MIGRATION_CHUNK = int(os.getenv("URL_MIGRATION_CHUNK", "500"))
+
+# ======================
+# Crawl Record & Replay
+# ======================
+# Каталог для записи трафика обходов в фикстуры (пусто — запись выключена)
+CRAWL_RECORD_DIR = os.getenv("CRAWL_RECORD_DIR", "")
+# Сколько запросов максимум держит selenium-wire при записи
+# (документ и редиректы сохраняются сверх лимита)
+FIXTURE_MAX_REQUESTS = int(os.getenv("FIXTURE_MAX_REQUESTS", "300"))
+
+# ======================
+# Outbound Telegram Queue
+# ======================
+# Лимиты Bot API: ~30 сообщений/с всего, ~1/с в личный чат, 20/мин в группу
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE   = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_GROUP_RATE  = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))
+# Сколько сообщений подряд можно отправить в чат без ожидания
+OUTBOX_CHAT_BURST  = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+
+# ======================
+# Diagnostics
+# ======================
+# Период замера задержки event loop и порог, после которого пишем в лог (секунды)
+DIAG_LAG_INTERVAL  = float(os.getenv("DIAG_LAG_INTERVAL", "0.5"))
+DIAG_LAG_WARN      = float(os.getenv("DIAG_LAG_WARN", "0.25"))
+# Сколько последних замеров держим для сводки
+DIAG_LAG_WINDOW    = int(os.getenv("DIAG_LAG_WINDOW", "600"))
+# Частота и максимальная длительность сэмплирующего профилировщика
+DIAG_PROFILE_HZ    = int(os.getenv("DIAG_PROFILE_HZ", "100"))
+DIAG_PROFILE_MAX_S = int(os.getenv("DIAG_PROFILE_MAX_S", "60"))
+
+# ======================
+# Watch List Scheduler
+# ======================
+# Как часто планировщик ищет проверки, подошедшие по времени (секунды)
+WATCH_TICK         = int(os.getenv("WATCH_TICK", "60"))
+# Окна для фоновых проверок по локальному времени сервера, через запятую.
+# Например: "01:00-07:00,13:00-14:00". Пусто — без ограничений.
+WATCH_WINDOWS      = os.getenv("WATCH_WINDOWS", "01:00-07:00")
+# Сколько проверок берём за один проход и сколько ссылок — на одну сессию браузера
+WATCH_BATCH_SIZE   = int(os.getenv("WATCH_BATCH_SIZE", "50"))
+WATCH_SESSION_SIZE = int(os.getenv("WATCH_SESSION_SIZE", "10"))
+# Минимальный интервал проверки и пауза перед повтором после ошибки (минуты)
+WATCH_MIN_INTERVAL = int(os.getenv("WATCH_MIN_INTERVAL", "60"))
+WATCH_RETRY_DELAY  = int(os.getenv("WATCH_RETRY_DELAY", "30"))
+# Сколько ссылок может отслеживать один пользователь
+WATCH_MAX_PER_USER = int(os.getenv("WATCH_MAX_PER_USER", "50"))
+
+# ======================
+# Multi-Device Fan-Out
+# ======================
+# Сколько профилей максимум обходим в одном /compare (один прокси на всех)
+FANOUT_MAX_DEVICES = int(os.getenv("FANOUT_MAX_DEVICES", "6"))
@@ -0,0 +1,161 @@
+# crawler/concurrency.py
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    CRAWL_MIN_SLOTS,
+    CRAWL_MAX_SLOTS,
+    CRAWL_INITIAL_SLOTS,
+    CRAWL_MIN_FREE_MB,
+    CRAWL_EXPECTED_MB,
+    CRAWL_MAX_LOAD,
+    CRAWL_TARGET_LATENCY,
+    CRAWL_DECREASE_COOLDOWN,
+    CRAWL_ADMISSION_POLL,
+)
+from crawler.memory import host_available_mb, host_load_per_cpu
+
+# Вес нового замера в экспоненциальном сглаживании
+_EWMA_ALPHA = 0.3
+
+
+class CrawlController:
+    """
+    Адаптивный (AIMD) лимит одновременных обходов.
+
+    • Additive increase: если все слоты были заняты и хост в порядке —
+      лимит растёт на 1 после каждого обхода.
+    • Multiplicative decrease: если мало свободной памяти, высокая загрузка CPU
+      или сглаженная длительность работы Chrome выше CRAWL_TARGET_LATENCY — лимит
+      делится пополам (не чаще раза в CRAWL_DECREASE_COOLDOWN).
+    • Admission: новый обход не стартует, пока после запуска ещё одного Chrome
+      свободной памяти останется меньше CRAWL_MIN_FREE_MB или load слишком высокий.
+
+    Живёт в event loop бота; сами обходы выполняются в self.executor.
+    """
+
+    def __init__(self):
+        self.limit = max(CRAWL_MIN_SLOTS, min(CRAWL_MAX_SLOTS, CRAWL_INITIAL_SLOTS))
+        self.active = 0
+        self.waiting = 0
+        self.waiting_background = 0
+        self.latency_ewma = None                 # секунды
+        self.crawl_mb_ewma = CRAWL_EXPECTED_MB   # пиковый RSS одного Chrome
+        self._last_decrease = 0.0
+        self._cond = None
+        # потоков столько, сколько слотов может быть максимум — лимит держит контроллер
+        self.executor = ThreadPoolExecutor(max_workers=CRAWL_MAX_SLOTS, thread_name_prefix="crawl")
+
+    def _condition(self) -> asyncio.Condition:
+        # создаём лениво, уже внутри работающего event loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    # ——— Состояние хоста ——————————————————————————————————
+
+    def _memory_tight(self, reserve_mb: float) -> bool:
+        available = host_available_mb()
+        return available is not None and available - reserve_mb < CRAWL_MIN_FREE_MB
+
+    def _cpu_tight(self) -> bool:
+        load = host_load_per_cpu()
+        return load is not None and load > CRAWL_MAX_LOAD
+
+    def _can_admit(self, background: bool = False) -> bool:
+        if background:
+            # фоновые обходы оставляют свободный слот и пропускают интерактивные вперёд
+            if self.active >= max(1, self.limit - 1) or self.waiting > self.waiting_background:
+                return False
+        if self.active >= self.limit:
+            return False
+        # хотя бы один обход пускаем всегда, иначе бот встанет намертво
+        if self.active == 0:
+            return True
+        return not (self._memory_tight(self.crawl_mb_ewma) or self._cpu_tight())
+
+    # ——— AIMD ———————————————————————————————————————————
+
+    def _adjust(self, was_saturated: bool):
+        now = time.monotonic()
+        congested = (
+            self._memory_tight(0)
+            or self._cpu_tight()
+            or (self.latency_ewma is not None and self.latency_ewma > CRAWL_TARGET_LATENCY)
+        )
+        if congested:
+            if now - self._last_decrease >= CRAWL_DECREASE_COOLDOWN:
+                self.limit = max(CRAWL_MIN_SLOTS, self.limit // 2)
+                self._last_decrease = now
+        elif was_saturated:
+            self.limit = min(CRAWL_MAX_SLOTS, self.limit + 1)
+
+    def observe(self, crawl_stats: dict):
+        """
+        Учитывает метрики обхода (см. fetch_redirect): длительность работы Chrome
+        без подбора прокси — сигнал перегрузки хоста, а реальный пиковый RSS
+        уточняет оценку запаса памяти под следующий обход.
+        """
+        elapsed = crawl_stats["duration_ms"] / 1000
+        if self.latency_ewma is None:
+            self.latency_ewma = elapsed
+        else:
+            self.latency_ewma += _EWMA_ALPHA * (elapsed - self.latency_ewma)
+
+        peak_kb = crawl_stats.get("chrome_peak_rss_kb")
+        if peak_kb:
+            self.crawl_mb_ewma += _EWMA_ALPHA * (peak_kb / 1024 - self.crawl_mb_ewma)
+
+    # ——— Слоты ——————————————————————————————————————————
+
+    @asynccontextmanager
+    async def slot(self, background: bool = False):
+        """
+        Занимает слот обхода на время блока (background=True — для фоновых
+        проверок: они не занимают последний свободный слот и ждут, пока
+        в очереди есть интерактивные обходы):
+            async with crawl_controller.slot():
+                await loop.run_in_executor(crawl_controller.executor, ...)
+        """
+        cond = self._condition()
+        async with cond:
+            self.waiting += 1
+            self.waiting_background += background
+            try:
+                while not self._can_admit(background):
+                    try:
+                        # ждём освобождения слота, но периодически перепроверяем хост
+                        await asyncio.wait_for(cond.wait(), timeout=CRAWL_ADMISSION_POLL)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+                self.waiting_background -= background
+            was_saturated = self.active + 1 >= self.limit
+            self.active += 1
+
+        try:
+            yield
+        finally:
+            async with cond:
+                self.active -= 1
+                self._adjust(was_saturated)
+                cond.notify_all()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit":         self.limit,
+            "active":        self.active,
+            "waiting":       self.waiting,
+            "background":    self.waiting_background,
+            "latency_s":     self.latency_ewma,
+            "crawl_mb":      int(self.crawl_mb_ewma),
+            "available_mb":  host_available_mb(),
+            "load_per_cpu":  host_load_per_cpu(),
+        }
+
+
+# Общий экземпляр на процесс
+crawl_controller = CrawlController()
@@ -0,0 +1,40 @@
+# crawler/fanout.py
+import asyncio
+
+from crawler.redirector import acquire_proxy
+from crawler.concurrency import crawl_controller
+from crawler.engines import crawl_engine
+
+
+async def fetch_redirect_fanout(raw_url: str, devices: list):
+    """
+    Обходит одну ссылку под несколькими профилями устройств одновременно.
+    Прокси подбирается один раз на всех (acquire_proxy), каждый профиль
+    обходится движком crawl_engine в отдельном слоте crawl_controller — итог
+    приходит за время самого медленного обхода, а не их суммы.
+
+    Возвращает кортеж:
+      (
+        ip: str|None,
+        isp: str|None,
+        proxy_attempts: list,
+        runs: list  # по порядку devices: (initial_url, final_url, crawl_stats)
+                    # либо исключение, если обход этого профиля упал
+      )
+
+    Если не удалось получить московский прокси — бросает ProxyAcquireError.
+    """
+    loop = asyncio.get_running_loop()
+    # подбор прокси не запускает Chrome, поэтому слот обхода под него не берём
+    proxy, proxy_attempts = await loop.run_in_executor(None, acquire_proxy)
+    _, ip_info = proxy
+
+    async def run(device: dict):
+        async with crawl_controller.slot():
+            initial_url, final_url, _, _, _, _, crawl_stats = await crawl_engine.fetch(
+                raw_url, device, proxy=proxy
+            )
+        return initial_url, final_url, crawl_stats
+
+    runs = await asyncio.gather(*(run(d) for d in devices), return_exceptions=True)
+    return ip_info.get("query"), ip_info.get("isp"), proxy_attempts, runs
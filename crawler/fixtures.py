@@ -0,0 +1,327 @@
+# crawler/fixtures.py
+import os
+import ssl
+import gzip
+import json
+import time
+import uuid
+import base64
+import asyncio
+import datetime
+import threading
+import importlib.util
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import CRAWL_RECORD_DIR, CAPTURE_MAX_HOPS
+
+FIXTURE_VERSION = 1
+
+
+def record_path() -> str | None:
+    """
+    Путь для новой фикстуры в CRAWL_RECORD_DIR, None — если запись выключена.
+    """
+    if not CRAWL_RECORD_DIR:
+        return None
+    os.makedirs(CRAWL_RECORD_DIR, exist_ok=True)
+    name = f"{datetime.datetime.utcnow():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.json.gz"
+    return os.path.join(CRAWL_RECORD_DIR, name)
+
+
+def save_fixture(path: str, url: str, final_url: str, device: dict, ip_info: dict, requests) -> None:
+    """
+    Сохраняет трафик обхода (driver.requests selenium-wire) в компактный
+    HAR-подобный gzip-JSON: запросы, ответы с телами и тайминги.
+      start_ms — смещение запроса от первого запроса обхода;
+      wait_ms  — сколько ждали ответа.
+    """
+    requests = sorted(requests, key=lambda r: r.date)
+    t0 = requests[0].date if requests else None
+    entries = []
+    for req in requests:
+        resp = req.response
+        if resp is None:
+            continue
+        entries.append({
+            "method": req.method,
+            "url": req.url,
+            "request_headers": list(req.headers.items()),
+            "status": resp.status_code,
+            "reason": resp.reason,
+            "response_headers": list(resp.headers.items()),
+            "body": base64.b64encode(resp.body or b"").decode("ascii"),
+            "start_ms": int((req.date - t0).total_seconds() * 1000),
+            "wait_ms": int((resp.date - req.date).total_seconds() * 1000),
+        })
+
+    fixture = {
+        "version": FIXTURE_VERSION,
+        "recorded_at": datetime.datetime.utcnow().isoformat(),
+        "url": url,
+        "final_url": final_url,
+        "device": device,
+        "ip_info": ip_info,
+        "entries": entries,
+    }
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False)
+
+
+def _is_document(request) -> bool:
+    # навигационные запросы Chrome: Sec-Fetch-Dest только для https,
+    # Upgrade-Insecure-Requests — для любой навигации
+    return (
+        request.headers.get("Sec-Fetch-Dest") in ("document", "iframe")
+        or "Upgrade-Insecure-Requests" in request.headers
+    )
+
+
+class FixtureRecorder:
+    """
+    Перехватчики selenium-wire для записи фикстуры.
+
+    Хранилище selenium-wire ограничено FIXTURE_MAX_REQUESTS и вытесняет
+    самые старые запросы — на тяжёлых лендингах это как раз документ
+    и редиректы, без которых фикстура не воспроизводится. Их ответы
+    recorder держит отдельно (не больше CAPTURE_MAX_HOPS), а requests()
+    объединяет их с тем, что осталось в хранилище.
+    Перехватчики работают в потоке mitm-бэкенда, поэтому только копят ссылки.
+    """
+
+    def __init__(self, max_pinned: int = CAPTURE_MAX_HOPS):
+        self.max_pinned = max_pinned
+        self._pinned = []
+        self._started = defaultdict(deque)   # (method, url) → даты запросов без ответа
+
+    def request_interceptor(self, request):
+        self._started[(request.method, request.url)].append(request.date)
+
+    def response_interceptor(self, request, response):
+        started = self._started.get((request.method, request.url))
+        if started:
+            # request здесь — новая копия, её date — момент ответа
+            request.date = started.popleft()
+        if len(self._pinned) < self.max_pinned and (
+            _is_document(request) or 300 <= response.status_code < 400
+        ):
+            self._pinned.append(request)
+
+    def requests(self, captured) -> list:
+        """
+        captured (driver.requests) + документы и редиректы, вытесненные из хранилища.
+        """
+        requests = list(captured)
+        seen = {(r.method, r.url, r.date) for r in requests}
+        requests.extend(r for r in self._pinned if (r.method, r.url, r.date) not in seen)
+        return requests
+
+
+def load_fixture(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        fixture = json.load(f)
+    if fixture.get("version") != FIXTURE_VERSION:
+        raise ValueError(f"{path}: неизвестная версия фикстуры {fixture.get('version')!r}")
+    return fixture
+
+
+class FixtureReplayer:
+    """
+    Ответы из фикстуры вместо сети: обход идёт без прокси и без живых страниц.
+    Для selenium-движка их отдаёт локальный FixtureServer (upstream-прокси
+    драйвера), для Playwright — route() через перехват запросов контекста.
+
+    Повторные запросы к одному URL отдаются в порядке записи.
+    Ответ отдаётся не раньше, чем пришёл в записи: через (start_ms + wait_ms)
+    от первого запроса обхода и не быстрее wait_ms от своего запроса —
+    так воспроизводится исходная временная шкала обхода. Все задержки
+    умножаются на scale (1.0 — как в оригинале, 0 — без задержек).
+    Запросы, которых нет в фикстуре, получают 404 и считаются в .misses.
+    """
+
+    def __init__(self, fixture: dict, scale: float = 1.0):
+        self.fixture = fixture
+        self.scale = scale
+        self.ip_info = fixture.get("ip_info") or {}
+        self.misses = 0
+        self._t0 = None          # когда пришёл первый запрос обхода
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        for entry in fixture["entries"]:
+            self._entries[(entry["method"], entry["url"])].append(entry)
+
+    def _delay(self, entry: dict, now: float) -> float:
+        """
+        Сколько секунд ждать с момента now перед ответом entry.
+        """
+        if not self.scale:
+            return 0.0
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = now - entry["start_ms"] * self.scale / 1000
+            due = self._t0 + (entry["start_ms"] + entry["wait_ms"]) * self.scale / 1000
+        return max(entry["wait_ms"] * self.scale / 1000, due - now)
+
+    def _next(self, method: str, url: str):
+        with self._lock:
+            queue = self._entries.get((method, url))
+            if not queue:
+                self.misses += 1
+                return None
+            # последний ответ оставляем для дальнейших повторов
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def respond(self, method: str, url: str) -> tuple:
+        """
+        Синхронный ответ на запрос: (status, reason, headers, body).
+        Ждёт по записанной шкале — вызывать из потока своего соединения.
+        """
+        now = time.monotonic()
+        entry = self._next(method, url)
+        if entry is None:
+            return 404, "Not Found", [("Content-Type", "text/plain")], b""
+        time.sleep(self._delay(entry, now))
+        return (
+            entry["status"],
+            entry.get("reason"),
+            entry["response_headers"],
+            base64.b64decode(entry["body"]),
+        )
+
+    async def route(self, route, request):
+        """
+        То же для Playwright: обработчик context.route("**/*", replayer.route).
+        """
+        now = time.monotonic()
+        entry = self._next(request.method, request.url)
+        if entry is None:
+            await route.fulfill(status=404, headers={"Content-Type": "text/plain"}, body=b"")
+            return
+        await asyncio.sleep(self._delay(entry, now))
+        # повторяющиеся заголовки (Set-Cookie) Playwright принимает через перевод строки
+        headers = {}
+        for name, value in entry["response_headers"]:
+            headers[name] = f"{headers[name]}\n{value}" if name in headers else value
+        await route.fulfill(
+            status=entry["status"],
+            headers=headers,
+            body=base64.b64decode(entry["body"]),
+        )
+
+
+# заголовки соединения из записи не передаём — длину тела считаем заново
+_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "content-length"}
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    """
+    HTTP-прокси поверх FixtureReplayer: обычные запросы приходят
+    с абсолютным URL, https — через CONNECT, внутри которого TLS
+    завершается прямо здесь (сертификат не проверяется: у selenium-wire
+    verify_ssl по умолчанию выключен).
+    """
+
+    protocol_version = "HTTP/1.1"
+    _base = None  # "https://host[:port]" внутри CONNECT-туннеля
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_CONNECT(self):
+        host, _, port = self.path.rpartition(":")
+        self.send_response(200, "Connection Established")
+        self.end_headers()
+        self.connection = self.server.tls.wrap_socket(self.connection, server_side=True)
+        self.rfile = self.connection.makefile("rb", self.rbufsize)
+        self.wfile = self.connection.makefile("wb")
+        self._base = f"https://{host}" if port == "443" else f"https://{self.path}"
+        self.close_connection = False
+
+    def _reply(self):
+        url = self.path if self._base is None else self._base + self.path
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        status, reason, headers, body = self.server.replayer.respond(self.command, url)
+        self.send_response_only(status, reason)
+        for name, value in headers:
+            if name.lower() not in _HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = _reply
+
+
+def _default_tls_files() -> tuple:
+    # сертификат selenium-wire; пакет не импортируем — нужен только путь
+    spec = importlib.util.find_spec("seleniumwire")
+    if spec is None:
+        raise RuntimeError("Для воспроизведения https нужен selenium-wire или certfile/keyfile")
+    base = os.path.dirname(spec.origin)
+    return os.path.join(base, "ca.crt"), os.path.join(base, "ca.key")
+
+
+class FixtureServer:
+    """
+    Локальный подменный сервер для selenium-движка: HTTP-прокси на 127.0.0.1,
+    который отвечает из FixtureReplayer. Драйвер ходит через него как через
+    upstream-прокси; каждое соединение обслуживается своим потоком, поэтому
+    ответы ждут каждый своего момента и параллельные в записи запросы
+    остаются параллельными (перехватчик selenium-wire выполняется в одном
+    потоке mitm-бэкенда и сериализовал бы их).
+
+        with FixtureServer(replayer) as server:
+            fetch_redirect(url, device, proxy=server.proxy)
+    """
+
+    def __init__(self, replayer: FixtureReplayer, certfile: str | None = None, keyfile: str | None = None):
+        self.replayer = replayer
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def proxy(self) -> tuple:
+        """
+        Прокси в формате acquire_proxy(): (proxy_auth, ip_info).
+        """
+        return self.url, self.replayer.ip_info
+
+    def start(self):
+        certfile, keyfile = self.certfile, self.keyfile
+        if certfile is None:
+            certfile, keyfile = _default_tls_files()
+        tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        tls.load_cert_chain(certfile, keyfile)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _ReplayHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.replayer = self.replayer
+        self._httpd.tls = tls
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="fixture-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
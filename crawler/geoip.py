@@ -0,0 +1,94 @@
+# crawler/geoip.py
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import maxminddb
+except ImportError:  # локальная GeoIP необязательна — тогда работаем через ip-api
+    maxminddb = None
+
+from config import GEOIP_CITY_DB, GEOIP_ASN_DB, GEOIP_CACHE_SIZE
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def _reader(path: str):
+    """
+    Лениво открывает .mmdb-базу в режиме memory-map (один раз на процесс).
+    База MaxMind — это бинарное дерево по битам IP, поэтому поиск
+    диапазона занимает O(длины адреса) без загрузки файла в память.
+    Возвращает None, если путь пустой, файла нет или maxminddb не установлен.
+    """
+    if maxminddb is None or not path or not os.path.isfile(path):
+        return None
+    with _readers_lock:
+        if path not in _readers:
+            _readers[path] = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        return _readers[path]
+
+
+def available() -> bool:
+    """
+    True, если доступна City-база (без неё Москву не проверить).
+    """
+    return _reader(GEOIP_CITY_DB) is not None
+
+
+_cache = OrderedDict()          # ip → результат (только найденные)
+_cache_lock = threading.Lock()
+
+
+def lookup(ip: str):
+    """
+    Определяет город и провайдера по exit-IP из локальных баз.
+    Найденные результаты кэшируются по IP: ротация прокси часто возвращает
+    те же адреса. Промахи не кэшируем — иначе IP, не найденный (или
+    проверенный до загрузки базы), так и остался бы без ответа до рестарта.
+
+    Возвращает dict в формате ответа ip-api:
+      {"query": str, "city": str, "isp": str|None}
+    либо None, если City-база недоступна или города для IP в ней нет
+    (тогда вызывающий код идёт в ip-api).
+    """
+    with _cache_lock:
+        info = _cache.get(ip)
+        if info is not None:
+            _cache.move_to_end(ip)
+            return info
+
+    info = _lookup(ip)
+    if info is not None:
+        with _cache_lock:
+            _cache[ip] = info
+            if len(_cache) > GEOIP_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return info
+
+
+def _lookup(ip: str):
+    city_db = _reader(GEOIP_CITY_DB)
+    if city_db is None:
+        return None
+    try:
+        rec = city_db.get(ip)
+    except ValueError:
+        # некорректный IP (например, echo-сервис вернул мусор)
+        return None
+    if not rec:
+        return None
+
+    city = (rec.get("city") or {}).get("names", {}).get("en")
+    if not city:
+        # диапазон известен только до страны — Москву так не проверить
+        return None
+
+    isp = None
+    asn_db = _reader(GEOIP_ASN_DB)
+    if asn_db is not None:
+        asn = asn_db.get(ip) or {}
+        # GeoIP2-ISP отдаёт "isp", GeoLite2-ASN — только организацию AS
+        isp = asn.get("isp") or asn.get("autonomous_system_organization")
+
+    return {"query": ip, "city": city, "isp": isp}
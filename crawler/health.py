@@ -0,0 +1,169 @@
+# crawler/health.py
+import math
+import time
+import datetime
+import threading
+from collections import deque
+
+from config import (
+    MAX_PROXY_ATTEMPTS,
+    PROXY_HEALTH_WINDOW,
+    PROXY_TARGET_SUCCESS,
+    PROXY_MIN_ATTEMPTS,
+    PROXY_MAX_ATTEMPTS_CAP,
+    PROXY_MAX_PARALLEL,
+    PROXY_BREAKER_MIN_SAMPLES,
+    PROXY_BREAKER_MIN_HIT_RATE,
+    PROXY_BREAKER_COOLDOWN,
+)
+
+MOSCOW = "Moscow"
+
+
+class ProxyHealth:
+    """
+    Скользящее окно попыток подбора прокси: доля «московских» IP и задержка проверки.
+    По нему подбираются бюджет попыток и число параллельных проверок,
+    а при явной деградации провайдера открывается circuit breaker.
+
+    Состояния breaker'а:
+      closed    — работаем как обычно;
+      open      — сразу отказываем, не тратя попытки;
+      half-open — после PROXY_BREAKER_COOLDOWN пропускаем один пробный подбор.
+
+    Потокобезопасен: вызывается из потоков executor'а.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque()          # (ts: float, hit: bool, latency_ms: int|None)
+        self._opened_at = None           # когда breaker открылся
+        self._trial_running = False      # идёт пробный подбор в half-open
+
+    # ——— Наполнение окна ————————————————————————————————
+
+    def record(self, city, latency_ms, ts: float | None = None):
+        """
+        Учитывает одну проверку прокси.
+        """
+        with self._lock:
+            self._samples.append((ts or time.time(), city == MOSCOW, latency_ms))
+            self._prune()
+            if self._opened_at is None and self._degraded():
+                self._opened_at = time.time()
+
+    def seed(self, logs):
+        """
+        Восстанавливает окно из сохранённых ProxyLog (после рестарта бота).
+        """
+        for log in sorted(logs, key=lambda l: l.timestamp):
+            ts = log.timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+            self.record(log.city, log.latency_ms, ts=ts)
+
+    def _prune(self):
+        border = time.time() - PROXY_HEALTH_WINDOW
+        while self._samples and self._samples[0][0] < border:
+            self._samples.popleft()
+
+    # ——— Метрики ———————————————————————————————————————
+
+    def _hit_rate(self) -> float | None:
+        if not self._samples:
+            return None
+        hits = sum(1 for _, hit, _ in self._samples if hit)
+        return hits / len(self._samples)
+
+    def _latency_p50(self) -> int | None:
+        lat = sorted(l for _, _, l in self._samples if l is not None)
+        return lat[len(lat) // 2] if lat else None
+
+    def _degraded(self) -> bool:
+        return (
+            len(self._samples) >= PROXY_BREAKER_MIN_SAMPLES
+            and self._hit_rate() < PROXY_BREAKER_MIN_HIT_RATE
+        )
+
+    def _plan(self) -> tuple[int, int]:
+        if not self._samples:
+            return MAX_PROXY_ATTEMPTS, 1
+        # сглаживаем, чтобы одна удача/неудача не давала 0 или 1
+        hits = sum(1 for _, hit, _ in self._samples if hit)
+        p = (hits + 1) / (len(self._samples) + 2)
+        # сколько попыток нужно, чтобы найти Москву с вероятностью PROXY_TARGET_SUCCESS
+        budget = math.ceil(math.log(1 - PROXY_TARGET_SUCCESS) / math.log(1 - p)) if p < 1 else 1
+        budget = max(PROXY_MIN_ATTEMPTS, min(PROXY_MAX_ATTEMPTS_CAP, budget))
+        # в среднем до попадания нужно 1/p попыток — проверяем их одновременно
+        parallel = max(1, min(PROXY_MAX_PARALLEL, round(1 / p), budget))
+        return budget, parallel
+
+    def plan(self) -> tuple[int, int]:
+        """
+        Возвращает (бюджет попыток, число параллельных проверок) по текущему окну.
+        """
+        with self._lock:
+            self._prune()
+            return self._plan()
+
+    # ——— Circuit breaker ——————————————————————————————————
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.time() - self._opened_at < PROXY_BREAKER_COOLDOWN:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        """
+        Можно ли сейчас подбирать прокси. В half-open пропускает только
+        один пробный подбор; его итог нужно сообщить через finish().
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def finish(self, success: bool):
+        """
+        Итог подбора прокси. Закрывает breaker после удачного пробного
+        подбора и заново открывает — после неудачного.
+        """
+        with self._lock:
+            if not self._trial_running:
+                return
+            self._trial_running = False
+            if success:
+                # старые неудачи не должны сразу открыть breaker снова
+                self._samples.clear()
+                self._opened_at = None
+            else:
+                self._opened_at = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        Сводка для админской команды статуса.
+        """
+        with self._lock:
+            self._prune()
+            budget, parallel = self._plan()
+            hit_rate = self._hit_rate()
+            retry_in = None
+            if self._state() == "open":
+                retry_in = int(PROXY_BREAKER_COOLDOWN - (time.time() - self._opened_at))
+            return {
+                "state":      self._state(),
+                "samples":    len(self._samples),
+                "hit_rate":   hit_rate,
+                "latency_ms": self._latency_p50(),
+                "budget":     budget,
+                "parallel":   parallel,
+                "retry_in":   retry_in,
+            }
+
+
+# Общий экземпляр на процесс
+proxy_health = ProxyHealth()
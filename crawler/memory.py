@@ -0,0 +1,107 @@
+# crawler/memory.py
+import os
+import threading
+
+try:
+    import psutil
+except ImportError:  # без psutil учёт памяти просто отключается
+    psutil = None
+
+from config import RSS_SAMPLE_INTERVAL
+
+
+def host_available_mb() -> int | None:
+    """
+    Доступная память хоста в МБ (MemAvailable), None — если узнать не удалось.
+    """
+    if psutil is not None:
+        return psutil.virtual_memory().available // (1024 * 1024)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def host_load_per_cpu() -> float | None:
+    """
+    Load average за минуту в пересчёте на одно ядро.
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+def _tree_rss_kb(proc) -> int:
+    """
+    Суммарный RSS процесса и всех его потомков (chromedriver → chrome → renderer'ы).
+    """
+    total = 0
+    for p in [proc, *proc.children(recursive=True)]:
+        try:
+            total += p.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return total // 1024
+
+
+class RssSampler:
+    """
+    Фоновый поток, который во время обхода замеряет пиковый RSS:
+      • дерева процессов Chrome (от PID chromedriver);
+      • процесса бота, внутри которого работает mitm-бэкенд selenium-wire
+        (он общий для параллельных обходов, поэтому это пик «по процессу»).
+
+    Использование:
+        sampler = RssSampler(driver.service.process.pid)
+        sampler.start()
+        ...
+        peaks = sampler.stop()   # {"chrome_peak_rss_kb": int|None, "backend_peak_rss_kb": int|None}
+    """
+
+    def __init__(self, root_pid: int | None):
+        self._root_pid = root_pid
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self.chrome_peak_kb = None
+        self.backend_peak_kb = None
+
+    def _sample(self, chrome, backend):
+        try:
+            chrome_kb = _tree_rss_kb(chrome)
+        except psutil.NoSuchProcess:
+            chrome_kb = None
+        backend_kb = backend.memory_info().rss // 1024
+
+        if chrome_kb is not None:
+            self.chrome_peak_kb = max(self.chrome_peak_kb or 0, chrome_kb)
+        self.backend_peak_kb = max(self.backend_peak_kb or 0, backend_kb)
+
+    def _run(self):
+        try:
+            chrome = psutil.Process(self._root_pid)
+        except psutil.NoSuchProcess:
+            return
+        backend = psutil.Process(os.getpid())
+        while True:
+            self._sample(chrome, backend)
+            if self._stop.wait(RSS_SAMPLE_INTERVAL):
+                return
+
+    def start(self):
+        if psutil is not None and self._root_pid:
+            self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+        return {
+            "chrome_peak_rss_kb":  self.chrome_peak_kb,
+            "backend_peak_rss_kb": self.backend_peak_kb,
+        }
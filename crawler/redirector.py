@@ -1,8 +1,11 @@
 # crawler/redirector.py
+import json
 import time
 import uuid
+import logging
 import requests
-from urllib.parse import unquote
+from urllib.parse import unquote, urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from seleniumwire import webdriver
 from selenium.webdriver.support.ui import WebDriverWait
@@ -14,18 +17,31 @@ from config import (
     PROXY_PASSWORD,
     PROXY_DNS,
     IP_API_URL,
+    IP_ECHO_URL,
+    IP_API_FALLBACK,
     CHECK_INTERVAL,
     REDIRECT_TIMEOUT,
-    MAX_PROXY_ATTEMPTS,
+    PROXY_MAX_PARALLEL,
+    CAPTURE_MAX_HOPS,
+    FIXTURE_MAX_REQUESTS,
 )
+from crawler import geoip
+from crawler.health import proxy_health
+from crawler.memory import RssSampler
+from crawler.fixtures import record_path, save_fixture, FixtureRecorder, FixtureServer
+
+log = logging.getLogger(__name__)
+
+# Общий пул для параллельной проверки прокси-кандидатов всеми обходами
+probe_pool = ThreadPoolExecutor(max_workers=PROXY_MAX_PARALLEL * 4, thread_name_prefix="proxy-probe")
 
 
 class ProxyAcquireError(Exception):
     """
     Выбрасывается, когда не удалось получить «московский» прокси
-    за MAX_PROXY_ATTEMPTS попыток.
+    за отведённый бюджет попыток.
     Атрибут .attempts — список всех попыток вида:
-      {"attempt": int, "ip": str|None, "city": str|None}
+      {"attempt": int, "ip": str|None, "city": str|None, "latency_ms": int}
     """
     def __init__(self, attempts):
         super().__init__(
@@ -34,90 +50,204 @@ class ProxyAcquireError(Exception):
         self.attempts = attempts
 
 
-def _acquire_moscow_proxy():
+class ProxyCircuitOpenError(ProxyAcquireError):
     """
-    Пытаемся получить прокси с IP из Москвы, не более MAX_PROXY_ATTEMPTS раз.
-    Возвращает кортеж (proxy_auth: str, info: dict, attempts: list).
-    Если не удаётся — бросает ProxyAcquireError(attempts).
+    Выбрасывается без единой попытки, когда circuit breaker открыт:
+    провайдер явно деградировал (см. crawler.health).
     """
-    attempts = []
+    def __init__(self):
+        Exception.__init__(self, "Прокси-провайдер деградировал, подбор временно отключён")
+        self.attempts = []
 
-    for attempt in range(1, MAX_PROXY_ATTEMPTS + 1):
-        # Формируем credentials для ротации сессии
-        session_id = uuid.uuid4().hex
-        user = f"{PROXY_USERNAME}-session-{session_id}"
-        proxy_auth = f"http://{user}:{PROXY_PASSWORD}@{PROXY_DNS}"
 
-        ip = city = None
-        info = {}
+def _probe_proxy(proxy_auth: str) -> dict:
+    """
+    Узнаёт exit-IP прокси и его геоданные.
+    Через прокси делаем только лёгкий IP-echo, а город/ISP берём
+    из локальной GeoIP-базы (crawler.geoip). Если базы нет или IP
+    в ней не найден — при IP_API_FALLBACK спрашиваем ip-api, как раньше.
+    Возвращает dict в формате ip-api ({"query", "city", "isp"}) или {} при ошибке.
+    """
+    proxies = {"http": proxy_auth, "https": proxy_auth}
+
+    if geoip.available():
         try:
-            resp = requests.get(
-                IP_API_URL,
-                proxies={"http": proxy_auth, "https": proxy_auth},
-                timeout=5
-            )
-            info = resp.json()
-            ip = info.get("query")
-            city = info.get("city")
+            ip = requests.get(IP_ECHO_URL, proxies=proxies, timeout=5).text.strip()
         except Exception:
-            # в случае ошибки оставляем ip, city = None
-            pass
+            ip = None
+        if ip:
+            info = geoip.lookup(ip)
+            if info:
+                return info
+        if not IP_API_FALLBACK:
+            return {"query": ip} if ip else {}
+
+    if not IP_API_FALLBACK:
+        return {}
+    try:
+        return requests.get(IP_API_URL, proxies=proxies, timeout=5).json()
+    except Exception:
+        # в случае ошибки оставляем ip, city = None
+        return {}
+
+
+def _new_proxy_auth() -> str:
+    # Формируем credentials для ротации сессии
+    session_id = uuid.uuid4().hex
+    user = f"{PROXY_USERNAME}-session-{session_id}"
+    return f"http://{user}:{PROXY_PASSWORD}@{PROXY_DNS}"
+
+
+def _check_candidate(proxy_auth: str):
+    """
+    Проверяет одного кандидата и учитывает результат в proxy_health.
+    Возвращает (info: dict, latency_ms: int).
+    """
+    started = time.monotonic()
+    info = _probe_proxy(proxy_auth)
+    latency_ms = int((time.monotonic() - started) * 1000)
+    proxy_health.record(info.get("city"), latency_ms)
+    return info, latency_ms
+
 
-        # Собираем данные попытки
-        attempts.append({"attempt": attempt, "ip": ip, "city": city})
+def _acquire_moscow_proxy():
+    """
+    Пытаемся получить прокси с IP из Москвы.
+    Бюджет попыток и число одновременно проверяемых кандидатов
+    берутся из proxy_health (по умолчанию — MAX_PROXY_ATTEMPTS по одному).
+    Возвращает кортеж (proxy_auth: str, info: dict, attempts: list).
+    Если не удаётся — бросает ProxyAcquireError(attempts);
+    если провайдер деградировал и breaker открыт — ProxyCircuitOpenError.
+    """
+    if not proxy_health.allow():
+        raise ProxyCircuitOpenError()
+
+    budget, parallel = proxy_health.plan()
+    attempts = []
+
+    try:
+        while len(attempts) < budget:
+            batch = min(parallel, budget - len(attempts))
+            futures = {
+                probe_pool.submit(_check_candidate, proxy_auth): proxy_auth
+                for proxy_auth in (_new_proxy_auth() for _ in range(batch))
+            }
+            # Первый «московский» кандидат выигрывает; остальные проверки
+            # досчитаются в фоне и попадут только в proxy_health
+            for fut in as_completed(futures):
+                info, latency_ms = fut.result()
+                city = info.get("city")
+
+                # Собираем данные попытки
+                attempts.append({
+                    "attempt": len(attempts) + 1,
+                    "ip": info.get("query"),
+                    "city": city,
+                    "latency_ms": latency_ms,
+                })
 
-        # Если IP в Москве — возвращаем результат
-        if city == "Moscow":
-            return proxy_auth, info, attempts
+                # Если IP в Москве — возвращаем результат
+                if city == "Moscow":
+                    proxy_health.finish(True)
+                    return futures[fut], info, attempts
 
-        # Иначе ждём перед следующей попыткой
-        time.sleep(CHECK_INTERVAL)
+            # Иначе ждём перед следующей пачкой
+            if len(attempts) < budget:
+                time.sleep(CHECK_INTERVAL)
+    except BaseException:
+        proxy_health.finish(False)
+        raise
 
     # Лимит попыток исчерпан — поднимаем ошибку с полным списком попыток
+    proxy_health.finish(False)
     raise ProxyAcquireError(attempts)
 
 
-def fetch_redirect(raw_url: str, device: dict):
+def _hop(response: dict, request_headers: dict | None) -> dict:
+    return {
+        "url": response.get("url"),
+        "status": response.get("status"),
+        "request_headers": response.get("requestHeaders") or request_headers or {},
+        "response_headers": response.get("headers") or {},
+    }
+
+
+def _collect_hops(driver) -> list:
     """
-    Синхронно обходит ссылку через «московский» прокси+эмуляцию устройства.
+    Достаёт из performance-лога Chrome только document- и redirect-переходы:
+    URL, статус, заголовки запроса и ответа — без тел, не больше CAPTURE_MAX_HOPS.
+    Лог содержит лишь метаданные CDP Network, поэтому память не зависит
+    от размера страниц (в отличие от хранилища selenium-wire).
+    """
+    try:
+        entries = driver.get_log("performance")
+    except WebDriverException:
+        return []
 
-    Параметры:
-      raw_url — строка, может не начинаться с http://|https://
-      device  — dict с ключами:
-        {
-          "ua": str,
-          "css_size": [width:int, height:int],
-          "platform": str,
-          "dpr": int,
-          "mobile": bool,
-          "model": str|None
-        }
+    hops = []
+    pending = {}  # requestId → заголовки текущего document-запроса
+    for entry in entries:
+        if len(hops) >= CAPTURE_MAX_HOPS:
+            break
+        msg = json.loads(entry["message"])["message"]
+        params = msg.get("params", {})
+        if params.get("type") != "Document":
+            continue
 
-    Возвращает кортеж:
-      (
-        initial_url: str,
-        final_url:   str,
-        ip:          str|None,
-        isp:         str|None,
-        device:      dict,       # тот же, что передан
-        proxy_attempts: list     # список всех попыток из _acquire_moscow_proxy
-      )
+        rid = params.get("requestId")
+        if msg.get("method") == "Network.requestWillBeSent":
+            # redirectResponse — ответ 3xx на предыдущий запрос с тем же requestId
+            if params.get("redirectResponse"):
+                hops.append(_hop(params["redirectResponse"], pending.get(rid)))
+            pending[rid] = params.get("request", {}).get("headers")
+        elif msg.get("method") == "Network.responseReceived":
+            hops.append(_hop(params.get("response", {}), pending.pop(rid, None)))
 
-    Если не удалось получить московский прокси — бросает ProxyAcquireError.
+    return hops
+
+
+def acquire_proxy():
     """
-    # 1) Нормализуем URL
-    url = raw_url if raw_url.startswith(("http://", "https://")) else f"https://{raw_url}"
-    initial_url = unquote(url)
+    Подбирает «московский» прокси для нескольких обходов сразу
+    (общая сессия для fetch_redirect(..., proxy=...) / fetch_redirects).
+    Возвращает (proxy: tuple, proxy_attempts: list); бросает ProxyAcquireError.
+    """
+    proxy_auth, ip_info, attempts = _acquire_moscow_proxy()
+    return (proxy_auth, ip_info), attempts
 
-    # 2) Подбираем московский прокси (или получаем ошибку)
-    proxy_auth, ip_info, proxy_attempts = _acquire_moscow_proxy()
 
-    # 3) Собираем опции для Selenium
+def normalize_target(raw_url: str) -> str:
+    """
+    Ссылка из сообщения → URL для перехода (без схемы — https://).
+    """
+    return raw_url if raw_url.startswith(("http://", "https://")) else f"https://{raw_url}"
+
+
+def stealth_script(platform: str) -> str:
+    """
+    JS, который подменяет navigator под эмулируемое устройство
+    (выполняется до скриптов страницы; общий для всех движков обхода).
+    """
+    return f"""
+        Object.defineProperty(navigator, 'platform', {{ get: () => '{platform}' }});
+        Object.defineProperty(navigator, 'languages', {{ get: () => ['ru-RU','ru'] }});
+        Object.defineProperty(navigator, 'language', {{ get: () => 'ru-RU' }});
+        Object.defineProperty(navigator, 'plugins', {{ get: () => [1,2,3,4,5] }});
+        Object.defineProperty(navigator, 'deviceMemory', {{ get: () => 8 }});
+        Object.defineProperty(navigator, 'hardwareConcurrency', {{ get: () => 8 }});
+        Object.defineProperty(navigator, 'connection', {{
+            get: () => {{ rtt:50, downlink:10, effectiveType:'4g' }}
+        }});
+    """
+
+
+def _start_driver(device: dict, proxy_auth: str | None, capture: bool):
+    """
+    Запускает Chrome (selenium-wire) с эмуляцией устройства и upstream-прокси.
+    capture=True включает перехват selenium-wire (нужен для записи фикстур).
+    """
     ua = device["ua"]
     css_w, css_h = device["css_size"]
-    platform = device["platform"]
-    dpr = device["dpr"]
-    mobile = device["mobile"]
 
     chrome_opts = webdriver.ChromeOptions()
     chrome_opts.add_argument("--headless=new")
@@ -125,53 +255,77 @@ def fetch_redirect(raw_url: str, device: dict):
     chrome_opts.add_argument("--no-sandbox")
     chrome_opts.add_argument("--disable-dev-shm-usage")
     chrome_opts.add_argument("--disable-blink-features=AutomationControlled")
+    # экономим память: без расширений и фоновых сервисов
+    # (картинки не отключаем — на них держатся пиксельные редирект-трекеры)
+    chrome_opts.add_argument("--disable-extensions")
+    chrome_opts.add_argument("--disable-background-networking")
     chrome_opts.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_opts.add_experimental_option("useAutomationExtension", False)
     chrome_opts.add_argument(f"--user-agent={ua}")
     chrome_opts.add_argument(f"--window-size={css_w},{css_h}")
     chrome_opts.set_capability("pageLoadStrategy", "none")
+    # переходы читаем из CDP Network-событий (только метаданные)
+    chrome_opts.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chrome_opts.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
 
     seleniumwire_opts = {
-        "proxy": {
-            "http": proxy_auth,
-            "https": proxy_auth,
-            "no_proxy": "localhost,127.0.0.1"
-        },
-        "request_storage": "memory",
         "connection_timeout": 10,
         "request_timeout": 30,
     }
+    if proxy_auth:
+        seleniumwire_opts["proxy"] = {
+            "http": proxy_auth,
+            "https": proxy_auth,
+            "no_proxy": "localhost,127.0.0.1"
+        }
+    if capture:
+        # запись требует перехвата selenium-wire; документ и редиректы
+        # FixtureRecorder держит отдельно от этого ограниченного хранилища
+        seleniumwire_opts["request_storage"] = "memory"
+        seleniumwire_opts["request_storage_max_size"] = FIXTURE_MAX_REQUESTS
+    else:
+        # selenium-wire только проксирует трафик: его хранилище держит
+        # тела ответов в памяти, а нам хватает заголовков из performance-лога
+        seleniumwire_opts["disable_capture"] = True
 
     driver = webdriver.Chrome(
         seleniumwire_options=seleniumwire_opts,
         options=chrome_opts,
     )
 
-    # stealth: прячем webdriver и эмулируем параметры устройства
+    try:
+        _prepare_driver(driver, device)
+    except BaseException:
+        # иначе Chrome и chromedriver останутся висеть
+        driver.quit()
+        raise
+    return driver
+
+
+def _prepare_driver(driver, device: dict):
+    """
+    stealth: прячем webdriver и эмулируем параметры устройства.
+    """
+    css_w, css_h = device["css_size"]
     driver.execute_cdp_cmd(
         "Page.addScriptToEvaluateOnNewDocument",
         {"source": "Object.defineProperty(navigator,'webdriver',{get:()=>undefined})"}
     )
     driver.execute_cdp_cmd(
         "Emulation.setDeviceMetricsOverride",
-        {"width": css_w, "height": css_h, "deviceScaleFactor": dpr, "mobile": mobile}
+        {"width": css_w, "height": css_h, "deviceScaleFactor": device["dpr"], "mobile": device["mobile"]}
     )
     driver.execute_cdp_cmd(
         "Page.addScriptToEvaluateOnNewDocument",
-        {"source": f"""
-            Object.defineProperty(navigator, 'platform', {{ get: () => '{platform}' }});
-            Object.defineProperty(navigator, 'languages', {{ get: () => ['ru-RU','ru'] }});
-            Object.defineProperty(navigator, 'language', {{ get: () => 'ru-RU' }});
-            Object.defineProperty(navigator, 'plugins', {{ get: () => [1,2,3,4,5] }});
-            Object.defineProperty(navigator, 'deviceMemory', {{ get: () => 8 }});
-            Object.defineProperty(navigator, 'hardwareConcurrency', {{ get: () => 8 }});
-            Object.defineProperty(navigator, 'connection', {{
-                get: () => {{ rtt:50, downlink:10, effectiveType:'4g' }}
-            }});
-        """}
+        {"source": stealth_script(device["platform"])}
     )
 
-    # 4) Переходим по URL и ждём первого редиректа
+
+def _resolve(driver, url: str) -> str:
+    """
+    Открывает url в уже запущенном драйвере и ждёт первого редиректа.
+    Возвращает текущий (итоговый) URL; загрузку страницы останавливает.
+    """
     try:
         driver.get(url)
     except (TimeoutException, WebDriverException):
@@ -184,12 +338,99 @@ def fetch_redirect(raw_url: str, device: dict):
     except TimeoutException:
         final_url = driver.current_url
 
-    # 5) Останавливаем загрузку и закрываем драйвер
     try:
         driver.execute_script("window.stop();")
     except Exception:
         pass
-    driver.quit()
+    return final_url
+
+
+def fetch_redirect(raw_url: str, device: dict, *, record_to: str | None = None, replay=None, proxy=None):
+    """
+    Синхронно обходит ссылку через «московский» прокси+эмуляцию устройства.
+
+    Параметры:
+      raw_url — строка, может не начинаться с http://|https://
+      device  — dict с ключами:
+        {
+          "ua": str,
+          "css_size": [width:int, height:int],
+          "platform": str,
+          "dpr": float,
+          "mobile": bool,
+          "model": str|None
+        }
+      record_to — путь для записи трафика в фикстуру (crawler.fixtures);
+                  по умолчанию — новый файл в CRAWL_RECORD_DIR, если он задан
+      replay    — FixtureReplayer: ответы отдаёт локальный FixtureServer
+                  (upstream-прокси драйвера), прокси не подбирается, IP/ISP — из записи
+      proxy     — уже подобранный прокси из acquire_proxy(); тогда
+                  proxy_attempts в результате пустой
+
+    Возвращает кортеж:
+      (
+        initial_url: str,
+        final_url:   str,
+        ip:          str|None,
+        isp:         str|None,
+        device:      dict,       # тот же, что передан
+        proxy_attempts: list,    # список всех попыток из _acquire_moscow_proxy
+        crawl_stats: dict        # длительность, пиковый RSS и document/redirect-переходы:
+                                 # {"duration_ms", "chrome_peak_rss_kb",
+                                 #  "backend_peak_rss_kb", "hops": list}
+      )
+
+    Если не удалось получить московский прокси — бросает ProxyAcquireError.
+    """
+    # 1) Нормализуем URL
+    url = normalize_target(raw_url)
+    initial_url = unquote(url)
+
+    # 2) Подбираем московский прокси (или получаем ошибку); при replay сеть не нужна
+    server = None
+    if replay is not None:
+        server = FixtureServer(replay).start()
+        (proxy_auth, ip_info), proxy_attempts = server.proxy, []
+        record_to = None
+    else:
+        if proxy is not None:
+            (proxy_auth, ip_info), proxy_attempts = proxy, []
+        else:
+            proxy_auth, ip_info, proxy_attempts = _acquire_moscow_proxy()
+        record_to = record_to or record_path()
+
+    # 3) Запускаем Chrome с эмуляцией устройства
+    started = time.monotonic()
+    try:
+        driver = _start_driver(device, proxy_auth, capture=bool(record_to))
+    except BaseException:
+        if server is not None:
+            server.stop()
+        raise
+    sampler = RssSampler(driver.service.process.pid)
+    recorder = None
+    try:
+        sampler.start()
+        if record_to:
+            recorder = FixtureRecorder()
+            driver.request_interceptor = recorder.request_interceptor
+            driver.response_interceptor = recorder.response_interceptor
+
+        # 4) Переходим по URL и ждём первого редиректа
+        final_url = _resolve(driver, url)
+        duration_ms = int((time.monotonic() - started) * 1000)
+
+        # 5) Снимаем переходы, пики памяти и закрываем драйвер
+        hops = _collect_hops(driver)
+        if recorder is not None:
+            save_fixture(record_to, url, unquote(final_url), device, ip_info,
+                         recorder.requests(driver.requests))
+    finally:
+        peaks = sampler.stop()
+        driver.quit()
+        if server is not None:
+            server.stop()
+    crawl_stats = {**peaks, "duration_ms": duration_ms, "hops": hops}
 
     return (
         initial_url,
@@ -197,5 +438,90 @@ def fetch_redirect(raw_url: str, device: dict):
         ip_info.get("query"),
         ip_info.get("isp"),
         device,
-        proxy_attempts
+        proxy_attempts,
+        crawl_stats
     )
+
+
+def _origins(urls) -> list:
+    """
+    Уникальные http(s)-origin'ы ("https://host:port") из списка URL.
+    """
+    origins = []
+    for url in urls:
+        try:
+            parts = urlsplit(url)
+        except ValueError:
+            continue
+        if parts.scheme in ("http", "https") and parts.netloc:
+            origin = f"{parts.scheme}://{parts.netloc.rsplit('@', 1)[-1].lower()}"
+            if origin not in origins:
+                origins.append(origin)
+    return origins
+
+
+def _reset_browser_state(driver, visited_urls):
+    """
+    Стирает cookies и HTTP-кэш всего браузера, а также storage
+    (localStorage, IndexedDB, service workers, Cache API) каждого
+    посещённого origin'а. Ошибки CDP не глотает.
+    """
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    for origin in _origins(visited_urls):
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+
+def fetch_redirects(raw_urls: list, device: dict, *, proxy=None):
+    """
+    Обходит несколько ссылок одним профилем устройства: один подбор прокси
+    и один запуск Chrome на всю пачку (между ссылками чистим cookies и storage).
+    Для фоновых проверок, где ссылок много, а выдача не срочная.
+
+    Возвращает кортеж:
+      (
+        ip: str|None,
+        isp: str|None,
+        proxy_attempts: list,
+        results: list  # [(initial_url, final_url, crawl_stats), ...] в порядке raw_urls
+      )
+
+    Если не удалось получить московский прокси — бросает ProxyAcquireError.
+    """
+    if proxy is not None:
+        (proxy_auth, ip_info), proxy_attempts = proxy, []
+    else:
+        proxy_auth, ip_info, proxy_attempts = _acquire_moscow_proxy()
+
+    results = []
+    driver = _start_driver(device, proxy_auth, capture=False)
+    try:
+        for raw_url in raw_urls:
+            url = normalize_target(raw_url)
+            started = time.monotonic()
+            sampler = RssSampler(driver.service.process.pid).start()
+            try:
+                final_url = _resolve(driver, url)
+                duration_ms = int((time.monotonic() - started) * 1000)
+            finally:
+                peaks = sampler.stop()
+            hops = _collect_hops(driver)
+            crawl_stats = {**peaks, "duration_ms": duration_ms, "hops": hops}
+            results.append((unquote(url), unquote(final_url), crawl_stats))
+
+            # следующая ссылка не должна видеть состояние предыдущей
+            # (включая промежуточные хосты цепочки редиректов)
+            visited = [url, final_url, *(h["url"] for h in hops if h.get("url"))]
+            try:
+                _reset_browser_state(driver, visited)
+            except WebDriverException:
+                # не удалось почистить — дальше только с чистым профилем
+                log.warning("Не удалось очистить состояние Chrome, перезапускаю", exc_info=True)
+                driver.quit()
+                driver = None
+                driver = _start_driver(device, proxy_auth, capture=False)
+    finally:
+        if driver is not None:
+            driver.quit()
+
+    return ip_info.get("query"), ip_info.get("isp"), proxy_attempts, results
@@ -1,16 +1,31 @@
 # db/crud.py
 
 import datetime
+from collections import Counter
 from typing import Optional, List
 
 from sqlalchemy.future import select
-from sqlalchemy import update, func, delete
-from .database import AsyncSessionLocal
+from sqlalchemy import update, func, delete, event, and_
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.dialects import postgresql, sqlite
+from config import EXPORT_CHUNK_SIZE, URL_CACHE_SIZE
+from .database import engine, get_session, commit, AsyncSessionLocal
 from .models import (
     User, UserStatus,
-    Event,
-    DeviceOption, ProxyLog
+    Event, Url,
+    DeviceOption, ProxyLog,
+    CrawlStat,
+    DailyHostStat, DailyIspStat, DailyStateStat,
+    WatchItem
 )
+from .urls import normalize_url, url_hash, url_host, LruCache
+from .devices import device_fingerprint, IOS_PLATFORMS
+
+# INSERT ... ON CONFLICT есть и в SQLite, и в PostgreSQL с одинаковым API
+_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+
+InitialUrl = aliased(Url)
+FinalUrl = aliased(Url)
 
 
 # --- Работа с пользователями ---
@@ -20,7 +35,7 @@ async def invite_user(username: str, role: str, invited_by: Optional[int]) -> Us
     Пригласить нового пользователя:
     создаёт запись с username, role и status='pending'.
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         user = User(
             tg_id=None,
             username=username,
@@ -30,8 +45,7 @@ async def invite_user(username: str, role: str, invited_by: Optional[int]) -> Us
             created_at=datetime.datetime.utcnow()
         )
         db.add(user)
-        await db.commit()
-        await db.refresh(user)
+        await commit(db)
         return user
 
 
@@ -41,7 +55,7 @@ async def activate_user(tg_id: int, username: str) -> Optional[User]:
     ищем запись User(username, status='pending'),
     заполняем tg_id, переводим в active и ставим activated_at.
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         result = await db.execute(
             select(User).where(
                 User.username == username,
@@ -55,12 +69,11 @@ async def activate_user(tg_id: int, username: str) -> Optional[User]:
         user.tg_id = tg_id
         user.status = UserStatus.active
         user.activated_at = datetime.datetime.utcnow()
-        await db.commit()
-        await db.refresh(user)
+        await commit(db)
         return user
 
 async def list_pending_users(invited_by: int | None = None) -> List[User]:
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         q = select(User).where(User.status == UserStatus.pending)
         if invited_by is not None:
             q = q.where(User.invited_by == invited_by)
@@ -68,16 +81,16 @@ async def list_pending_users(invited_by: int | None = None) -> List[User]:
         return result.scalars().all()
 
 async def revoke_invitation(user_id: int) -> bool:
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         res = await db.execute(delete(User).where(User.id == user_id))
-        await db.commit()
+        await commit(db)
         return bool(res.rowcount)
 
 async def get_user_by_tg(tg_id: int) -> Optional[User]:
     """
     Возвращает User по telegram_id, либо None.
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         result = await db.execute(
             select(User).where(User.tg_id == tg_id)
         )
@@ -89,14 +102,14 @@ async def block_user_by_username(username: str) -> bool:
     Ставит статус 'blocked' у пользователя с данным username.
     Возвращает True, если был обновлён хотя бы один ряд.
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         stmt = (
             update(User)
             .where(User.username == username)
             .values(status=UserStatus.blocked)
         )
         res = await db.execute(stmt)
-        await db.commit()
+        await commit(db)
         return bool(res.rowcount)
 
 async def get_user_stats(user_id: int) -> dict:
@@ -106,7 +119,7 @@ async def get_user_stats(user_id: int) -> dict:
       – за последний месяц
       – за последнюю неделю
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         now = datetime.datetime.utcnow()
         month_ago = now - datetime.timedelta(days=30)
         week_ago  = now - datetime.timedelta(days=7)
@@ -145,7 +158,7 @@ async def list_active_users() -> List[User]:
     """
     Возвращает всех пользователей со статусом active
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         result = await db.execute(
             select(User).where(User.status == UserStatus.active)
         )
@@ -156,7 +169,7 @@ async def get_user_by_id(user_id: int) -> Optional[User]:
     """
     Возвращает User по его internal ID
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         result = await db.execute(
             select(User).where(User.id == user_id)
         )
@@ -164,51 +177,476 @@ async def get_user_by_id(user_id: int) -> Optional[User]:
 
 # --- Исправленный импорт позволяет корректно выбирать случайное устройство ---
 
-async def get_random_device() -> dict:
+_DEVICE_CLASS_FILTERS = {
+    "ios":     DeviceOption.platform.in_(IOS_PLATFORMS),
+    "android": and_(DeviceOption.mobile.is_(True), DeviceOption.platform.not_in(IOS_PLATFORMS)),
+    "desktop": DeviceOption.mobile.is_(False),
+}
+
+
+async def get_random_device(device_class: Optional[str] = None) -> dict:
     """
-    Возвращает случайный профиль устройства из БД.
+    Возвращает случайный профиль устройства из БД
+    (при device_class — только из этого класса: ios / android / desktop).
     """
-    async with AsyncSessionLocal() as db:
-        result = await db.execute(
+    async with get_session() as db:
+        q = (
             select(DeviceOption)
+            .where(DeviceOption.enabled.is_(True))
             .order_by(func.random())    # теперь func определён
             .limit(1)
         )
+        if device_class is not None:
+            q = q.where(_DEVICE_CLASS_FILTERS[device_class])
+        result = await db.execute(q)
         dev = result.scalars().first()
         if not dev:
-            raise ValueError("В базе нет ни одного профиля устройства")
-        return {
-            "id": dev.id,
-            "ua": dev.ua,
-            "css_size": dev.css_size,
-            "platform": dev.platform,
-            "dpr": dev.dpr,
-            "mobile": bool(dev.mobile),
-            "model": dev.model,
-        }
+            raise ValueError(
+                "В базе нет ни одного профиля устройства"
+                + (f" класса {device_class}" if device_class else "")
+            )
+        return _device_dict(dev)
+
+
+def _device_dict(dev: DeviceOption) -> dict:
+    return {
+        "id": dev.id,
+        "ua": dev.ua,
+        "css_size": dev.css_size,
+        "platform": dev.platform,
+        "dpr": dev.dpr,
+        "mobile": bool(dev.mobile),
+        "model": dev.model,
+    }
+
+
+# --- Каталог профилей устройств ---
+
+_DEVICE_FIELDS = ("ua", "css_size", "platform", "dpr", "mobile", "model", "enabled", "seen_at")
+
+
+async def backfill_device_fingerprints() -> int:
+    """
+    Проставляет fingerprint профилям, созданным до появления этого поля,
+    чтобы импорт каталога обновлял их, а не создавал дубликаты
+    (и ссылки Event.device_option_id оставались валидными).
+    """
+    async with get_session() as db:
+        taken = set((await db.execute(
+            select(DeviceOption.fingerprint).where(DeviceOption.fingerprint.is_not(None))
+        )).scalars())
+        legacy = (await db.execute(
+            select(DeviceOption).where(DeviceOption.fingerprint.is_(None))
+        )).scalars().all()
+        updated = 0
+        for dev in legacy:
+            fp = device_fingerprint({
+                "ua": dev.ua, "css_size": dev.css_size, "platform": dev.platform,
+                "dpr": dev.dpr, "mobile": dev.mobile,
+            })
+            if fp in taken:
+                continue  # дубликат — оставляем без ключа
+            dev.fingerprint = fp
+            taken.add(fp)
+            updated += 1
+        await commit(db)
+        return updated
+
+
+async def upsert_devices(batch: List[dict]) -> None:
+    """
+    Пачкой вставляет или обновляет профили (INSERT ... ON CONFLICT по fingerprint).
+    id существующих профилей не меняются. Записи — результат validate_device()
+    с полями enabled и seen_at.
+    """
+    if not batch:
+        return
+    stmt = _insert(DeviceOption.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["fingerprint"],
+        set_={f: stmt.excluded[f] for f in _DEVICE_FIELDS},
+    )
+    async with get_session() as db:
+        await db.execute(stmt, batch)
+        await commit(db)
+
+
+async def disable_unseen_devices(seen_before: datetime.datetime) -> int:
+    """
+    Отключает (а не удаляет) профили, которых не было в последнем импорте.
+    """
+    async with get_session() as db:
+        res = await db.execute(
+            update(DeviceOption)
+            .where(
+                DeviceOption.enabled.is_(True),
+                (DeviceOption.seen_at.is_(None)) | (DeviceOption.seen_at < seen_before),
+            )
+            .values(enabled=False)
+        )
+        await commit(db)
+        return res.rowcount
 
 
 async def create_proxy_log(
     attempt: int,
     ip: Optional[str],
-    city: Optional[str]
+    city: Optional[str],
+    latency_ms: Optional[int] = None
 ) -> ProxyLog:
     """
     Логирует попытку подобрать прокси.
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         log = ProxyLog(
             attempt=attempt,
             ip=ip,
             city=city,
+            latency_ms=latency_ms,
             timestamp=datetime.datetime.utcnow()
         )
         db.add(log)
-        await db.commit()
-        await db.refresh(log)
+        await commit(db)
         return log
 
 
+async def list_proxy_logs_since(since: datetime.datetime) -> List[ProxyLog]:
+    """
+    Возвращает попытки подбора прокси начиная с since
+    (для восстановления модели здоровья провайдера после рестарта).
+    """
+    async with get_session() as db:
+        result = await db.execute(
+            select(ProxyLog).where(ProxyLog.timestamp >= since)
+        )
+        return result.scalars().all()
+
+
+async def stream_events(
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+    username: Optional[str] = None,
+    state: Optional[str] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """
+    Асинхронный генератор пачек событий (list[dict]) вместе с пользователем
+    и профилем устройства. Пачки читаются по ключу (Event.id > последнего),
+    каждая в своей короткой сессии: между пачками SQLite-блокировка
+    чтения снята и запись новых событий не ждёт конца выгрузки.
+    В памяти одновременно не больше chunk_size строк. date_to — не включительно.
+    """
+    q = (
+        select(
+            Event.id,
+            Event.timestamp,
+            User.username,
+            Event.state,
+            InitialUrl.text.label("initial_url"),
+            FinalUrl.text.label("final_url"),
+            Event.ip,
+            Event.isp,
+            DeviceOption.model.label("device_model"),
+            DeviceOption.ua.label("device_ua"),
+        )
+        .join(User, Event.user_id == User.id)
+        # у событий без ссылки device_option_id=0 — профиля нет
+        .outerjoin(DeviceOption, Event.device_option_id == DeviceOption.id)
+        .outerjoin(InitialUrl, Event.initial_url_id == InitialUrl.id)
+        .outerjoin(FinalUrl, Event.final_url_id == FinalUrl.id)
+        .order_by(Event.id)
+        .limit(chunk_size)
+    )
+    if date_from is not None:
+        q = q.where(Event.timestamp >= date_from)
+    if date_to is not None:
+        q = q.where(Event.timestamp < date_to)
+    if username is not None:
+        q = q.where(User.username == username)
+    if state is not None:
+        q = q.where(Event.state == state)
+
+    last_id = 0
+    while True:
+        # своя сессия, а не сессия unit of work: соединение отдаётся в пул после пачки
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(q.where(Event.id > last_id))).all()
+        if not rows:
+            return
+        yield [row._asdict() for row in rows]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+
+# --- Словарь URL ---
+
+# нормализованный текст → id уже закоммиченных URL
+# (ключ — сам текст: при коллизии хэшей id не перепутается)
+_url_cache = LruCache(URL_CACHE_SIZE)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_new_urls(session):
+    # новые URL попадают в общий кэш только после коммита,
+    # иначе при откате в кэше остались бы несуществующие id
+    for text, url_id in session.info.pop("new_urls", {}).items():
+        _url_cache.put(text, url_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_new_urls(session):
+    session.info.pop("new_urls", None)
+
+
+async def _intern_url(db, url: str) -> Optional[int]:
+    """
+    Возвращает id URL в словаре urls, добавляя его при необходимости.
+    Сначала смотрим LRU-кэш, затем — точечный запрос по индексу хэша.
+    """
+    if not url:
+        return None
+    text = normalize_url(url)
+
+    url_id = _url_cache.get(text)
+    if url_id is not None:
+        return url_id
+    pending = db.sync_session.info.setdefault("new_urls", {})
+    if text in pending:
+        return pending[text]
+
+    h = url_hash(text)
+    lookup = select(Url.id).where(Url.hash == h, Url.text == text).limit(1)
+    url_id = (await db.execute(lookup)).scalar()
+    if url_id is not None:
+        _url_cache.put(text, url_id)
+        return url_id
+
+    # параллельный апдейт мог успеть вставить тот же URL — тогда берём его строку
+    await db.execute(
+        _insert(Url)
+        .values(hash=h, text=text, host=url_host(text))
+        .on_conflict_do_nothing(index_elements=["hash", "text"])
+    )
+    url_id = (await db.execute(lookup)).scalar_one()
+    pending[text] = url_id
+    return url_id
+
+
+# Состояния событий, в которых ссылка была успешно раскрыта
+RESOLVED_STATES = ("success", "watch")
+
+
+async def get_last_resolution(url: str, user_id: Optional[int] = None) -> Optional[dict]:
+    """
+    Последний успешный результат обхода этой ссылки (при user_id — этим пользователем):
+      {"final_url": str, "timestamp": datetime} либо None.
+    Два точечных запроса по индексам: хэш URL и (initial_url_id, timestamp).
+    """
+    text = normalize_url(url)
+    async with get_session() as db:
+        url_ids = select(Url.id).where(Url.hash == url_hash(text), Url.text == text)
+        q = (
+            select(FinalUrl.text, Event.timestamp)
+            .join(FinalUrl, Event.final_url_id == FinalUrl.id)
+            .where(Event.initial_url_id.in_(url_ids), Event.state.in_(RESOLVED_STATES))
+            .order_by(Event.timestamp.desc())
+            .limit(1)
+        )
+        if user_id is not None:
+            q = q.where(Event.user_id == user_id)
+        row = (await db.execute(q)).first()
+    if row is None:
+        return None
+    return {"final_url": row.text, "timestamp": row.timestamp}
+
+
+# --- Список наблюдения ---
+
+async def add_watch(user_id: int, url: str, interval_minutes: int, device_class: Optional[str]) -> WatchItem:
+    """
+    Добавляет ссылку в список наблюдения; первая проверка — при ближайшем окне.
+    """
+    async with get_session() as db:
+        item = WatchItem(
+            user_id=user_id,
+            url_id=await _intern_url(db, url),
+            device_class=device_class,
+            interval_minutes=interval_minutes,
+            next_check_at=datetime.datetime.utcnow(),
+            created_at=datetime.datetime.utcnow()
+        )
+        db.add(item)
+        await commit(db)
+        return item
+
+
+async def count_user_watches(user_id: int) -> int:
+    async with get_session() as db:
+        return (await db.execute(
+            select(func.count()).select_from(WatchItem).where(WatchItem.user_id == user_id)
+        )).scalar_one()
+
+
+async def list_user_watches(user_id: int) -> List[dict]:
+    async with get_session() as db:
+        rows = (await db.execute(
+            select(WatchItem, Url.text)
+            .join(Url, WatchItem.url_id == Url.id)
+            .where(WatchItem.user_id == user_id)
+            .order_by(WatchItem.id)
+        )).all()
+    return [
+        {
+            "id": item.id,
+            "url": url,
+            "device_class": item.device_class,
+            "interval_minutes": item.interval_minutes,
+            "next_check_at": item.next_check_at,
+        }
+        for item, url in rows
+    ]
+
+
+async def delete_watch(watch_id: int, user_id: int) -> bool:
+    async with get_session() as db:
+        res = await db.execute(
+            delete(WatchItem).where(WatchItem.id == watch_id, WatchItem.user_id == user_id)
+        )
+        await commit(db)
+        return bool(res.rowcount)
+
+
+async def list_due_watches(now: datetime.datetime, limit: int) -> List[dict]:
+    """
+    Проверки, время которых подошло (самые просроченные — первыми),
+    только для активных пользователей.
+    """
+    async with get_session() as db:
+        rows = (await db.execute(
+            select(WatchItem, Url.text, User.tg_id)
+            .join(Url, WatchItem.url_id == Url.id)
+            .join(User, WatchItem.user_id == User.id)
+            .where(WatchItem.next_check_at <= now, User.status == UserStatus.active)
+            .order_by(WatchItem.next_check_at)
+            .limit(limit)
+        )).all()
+    return [
+        {
+            "id": item.id,
+            "user_id": item.user_id,
+            "tg_id": tg_id,
+            "url": url,
+            "device_class": item.device_class,
+            "interval_minutes": item.interval_minutes,
+        }
+        for item, url, tg_id in rows
+    ]
+
+
+async def reschedule_watch(watch_id: int, next_check_at: datetime.datetime) -> None:
+    async with get_session() as db:
+        await db.execute(
+            update(WatchItem).where(WatchItem.id == watch_id).values(next_check_at=next_check_at)
+        )
+        await commit(db)
+
+
+# --- Агрегаты по событиям ---
+
+_AGGREGATES = (
+    (DailyStateStat, "state"),
+    (DailyHostStat,  "host"),
+    (DailyIspStat,   "isp"),
+)
+
+
+async def _bump_counter(db, model, key_col: str, day: datetime.date, key: str, n: int = 1):
+    stmt = _insert(model).values(day=day, count=n, **{key_col: key})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", key_col],
+        set_={"count": model.count + stmt.excluded.count},
+    )
+    await db.execute(stmt)
+
+
+async def _bump_event_aggregates(db, day, state: str, host: Optional[str], isp: Optional[str]):
+    """
+    Увеличивает дневные счётчики по состоянию, хосту итогового URL и ISP.
+    Хост извлекается один раз здесь, при вставке события.
+    """
+    for (model, key_col), key in zip(_AGGREGATES, (state, host, isp)):
+        if key:
+            await _bump_counter(db, model, key_col, day, key)
+
+
+async def rebuild_event_aggregates() -> bool:
+    """
+    Однократно заполняет агрегаты по уже накопленной истории событий,
+    если таблицы агрегатов пусты (например, сразу после их появления).
+    События читаются потоково; в памяти — только счётчики по дням.
+    Возвращает True, если заполнение выполнялось.
+    """
+    async with get_session() as db:
+        has_aggregates = (await db.execute(select(DailyStateStat.day).limit(1))).first()
+        has_events = (await db.execute(select(Event.id).limit(1))).first()
+        if has_aggregates or not has_events:
+            return False
+
+        counters = [Counter() for _ in _AGGREGATES]
+        result = await db.stream(
+            select(Event.timestamp, Event.state, FinalUrl.host, Event.isp)
+            .outerjoin(FinalUrl, Event.final_url_id == FinalUrl.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for ts, state, host, isp in result:
+            for counter, key in zip(counters, (state, host, isp)):
+                if key:
+                    counter[(ts.date(), key)] += 1
+
+        for (model, key_col), counter in zip(_AGGREGATES, counters):
+            for (day, key), n in counter.items():
+                await _bump_counter(db, model, key_col, day, key, n)
+        await commit(db)
+        return True
+
+
+async def get_global_stats(days: int, top: int = 10) -> dict:
+    """
+    Сводка по всем пользователям за последние days дней — только из агрегатов:
+      {"total": int, "success": int, "states": [(state, n)],
+       "hosts": [(host, n)], "isps": [(isp, n)]}
+    """
+    since = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)
+
+    async def _top(model, key_col, limit):
+        key = getattr(model, key_col)
+        total = func.sum(model.count)
+        q = (
+            select(key, total)
+            .where(model.day >= since)
+            .group_by(key)
+            .order_by(total.desc())
+        )
+        if limit:
+            q = q.limit(limit)
+        return [tuple(r) for r in (await db.execute(q)).all()]
+
+    async with get_session() as db:
+        states = await _top(DailyStateStat, "state", None)
+        hosts = await _top(DailyHostStat, "host", top)
+        isps = await _top(DailyIspStat, "isp", top)
+
+    return {
+        "total":   sum(n for _, n in states),
+        # перепроверки из списков наблюдения — тоже успешные обходы
+        "success": sum(n for state, n in states if state in RESOLVED_STATES),
+        "states":  states,
+        "hosts":   hosts,
+        "isps":    isps,
+    }
+
+
 async def create_event(
     user_id: int,
     state: str,
@@ -219,20 +657,42 @@ async def create_event(
     isp: Optional[str]
 ) -> Event:
     """
-    Логирует результат обхода ссылки.
+    Логирует результат обхода ссылки. URL сохраняются в словарь urls,
+    событие хранит только их id.
     """
-    async with AsyncSessionLocal() as db:
+    async with get_session() as db:
         ev = Event(
             user_id=user_id,
             state=state,
             device_option_id=device_option_id,
-            initial_url=initial_url,
-            final_url=final_url,
+            initial_url_id=await _intern_url(db, initial_url),
+            final_url_id=await _intern_url(db, final_url),
             ip=ip,
             isp=isp,
             timestamp=datetime.datetime.utcnow()
         )
         db.add(ev)
-        await db.commit()
-        await db.refresh(ev)
+        await _bump_event_aggregates(
+            db, ev.timestamp.date(), state, url_host(final_url), isp
+        )
+        await commit(db)
         return ev
+
+
+async def create_crawl_stat(event_id: int, crawl_stats: dict) -> CrawlStat:
+    """
+    Сохраняет метрики обхода (длительность, пиковый RSS, цепочку переходов).
+    Заголовки переходов не храним — только URL и статус.
+    """
+    async with get_session() as db:
+        stat = CrawlStat(
+            event_id=event_id,
+            duration_ms=crawl_stats["duration_ms"],
+            chrome_peak_rss_kb=crawl_stats["chrome_peak_rss_kb"],
+            backend_peak_rss_kb=crawl_stats["backend_peak_rss_kb"],
+            hops=[{"url": h["url"], "status": h["status"]} for h in crawl_stats["hops"]],
+            timestamp=datetime.datetime.utcnow()
+        )
+        db.add(stat)
+        await commit(db)
+        return stat
@@ -1,5 +1,8 @@
 # db/database.py
 
+from contextvars import ContextVar
+from contextlib import asynccontextmanager
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from config import DATABASE_URL
@@ -21,13 +24,99 @@ AsyncSessionLocal = sessionmaker(
 # Базовый класс для моделей
 Base = declarative_base()
 
-async def init_db():
+# Сессия текущего unit of work (одного Telegram-апдейта), если он открыт
+_current_session: ContextVar = ContextVar("current_session", default=None)
+
+
+@asynccontextmanager
+async def unit_of_work():
     """
-    Инициализирует БД: создаёт все таблицы, описанные в моделях.
+    Открывает одну сессию на весь блок (обычно — на обработку апдейта).
+    CRUD-функции внутри блока переиспользуют её через get_session(),
+    а их commit() превращается во flush: все записи уходят одной
+    транзакцией при выходе из блока (или откатываются при исключении).
+    Вложенный unit_of_work() просто переиспользует внешний.
+    """
+    current = _current_session.get()
+    if current is not None:
+        yield current
+        return
+
+    async with AsyncSessionLocal() as db:
+        token = _current_session.set(db)
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        finally:
+            _current_session.reset(token)
+
+
+@asynccontextmanager
+async def get_session():
+    """
+    Сессия для CRUD-функции: сессия текущего unit of work либо новая.
+    """
+    current = _current_session.get()
+    if current is not None:
+        yield current
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def commit(db: AsyncSession):
+    """
+    Фиксирует изменения CRUD-функции. Внутри unit of work только flush
+    (сгенерированные id уже доступны), коммит делает сам unit_of_work().
+    """
+    if _current_session.get() is db:
+        await db.flush()
+    else:
+        await db.commit()
+
+
+async def checkpoint():
+    """
+    Коммитит накопленное в unit of work и возвращает соединение в пул.
+    Вызывается перед долгими операциями (обход ссылки), чтобы не держать
+    соединение и блокировки SQLite, пока ждём браузер. Сессию можно
+    использовать дальше — соединение возьмётся заново при следующем запросе.
+    """
+    current = _current_session.get()
+    if current is not None:
+        await current.commit()
+
+async def create_schema():
+    """
+    Создаёт недостающие таблицы, колонки и индексы (без разрушающих шагов).
     """
     # Импортируем модели, чтобы SQLAlchemy их зарегистрировал
     import db.models  # noqa: F401
 
-    # Создаём таблицы в БД
+    from db.migrations import add_missing_columns, dedupe_urls
+
+    # Создаём таблицы в БД и досоздаём новые колонки в уже существующих;
+    # дубли urls убираем до создания уникального индекса
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(dedupe_urls)
+        await conn.run_sync(add_missing_columns)
+
+
+async def init_db():
+    """
+    Инициализирует БД: создаёт все таблицы, описанные в моделях.
+    Старую схему с текстовыми URL в events не трогает — просит
+    выполнить migrate_urls.py (миграция удаляет колонки).
+    """
+    from db.migrations import needs_url_migration
+
+    await create_schema()
+    if await needs_url_migration(engine):
+        raise RuntimeError(
+            "В events остались текстовые URL: сделай резервную копию БД "
+            "и выполни python migrate_urls.py"
+        )
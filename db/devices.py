@@ -0,0 +1,75 @@
+# db/devices.py
+
+import hashlib
+import json
+
+REQUIRED_FIELDS = ("ua", "css_size", "platform", "dpr", "mobile")
+
+# Классы устройств для выбора профиля (списки наблюдения, сравнение по профилям)
+DEVICE_CLASSES = ("ios", "android", "desktop")
+IOS_PLATFORMS = ("iPhone", "iPad", "iPod")
+
+
+def validate_device(record: dict) -> dict:
+    """
+    Проверяет и приводит запись каталога к виду строки device_options.
+    Бросает ValueError с описанием проблемы.
+    """
+    missing = [f for f in REQUIRED_FIELDS if record.get(f) in (None, "")]
+    if missing:
+        raise ValueError(f"нет полей: {', '.join(missing)}")
+
+    ua = str(record["ua"]).strip()
+    platform = str(record["platform"]).strip()
+    if not ua or not platform:
+        raise ValueError("пустой ua или platform")
+
+    try:
+        width, height = (int(v) for v in record["css_size"])
+    except (TypeError, ValueError):
+        raise ValueError(f"css_size должен быть [width, height]: {record['css_size']!r}")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"неположительный css_size: {record['css_size']!r}")
+
+    try:
+        dpr = float(record["dpr"])
+    except (TypeError, ValueError):
+        raise ValueError(f"dpr не число: {record['dpr']!r}")
+    if not 0.5 <= dpr <= 5:
+        raise ValueError(f"dpr вне диапазона: {dpr}")
+
+    mobile = record["mobile"]
+    if isinstance(mobile, str):
+        if mobile.strip().lower() not in ("1", "0", "true", "false", "yes", "no"):
+            raise ValueError(f"mobile не булево: {mobile!r}")
+        mobile = mobile.strip().lower() in ("1", "true", "yes")
+
+    device = {
+        "ua": ua,
+        "css_size": [width, height],
+        "platform": platform,
+        "dpr": dpr,
+        "mobile": bool(mobile),
+        "model": (str(record["model"]).strip() or None) if record.get("model") else None,
+    }
+    device["fingerprint"] = device_fingerprint(device)
+    return device
+
+
+def device_fingerprint(device: dict) -> str:
+    """
+    Стабильный ключ профиля: хэш параметров, которые влияют на эмуляцию.
+    Название модели не входит — его можно уточнять без создания нового профиля.
+    """
+    key = json.dumps(
+        [
+            device["ua"],
+            list(device["css_size"]),
+            device["platform"],
+            float(device["dpr"]),
+            bool(device["mobile"]),
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
@@ -0,0 +1,42 @@
+# db/export.py
+
+import csv
+import gzip
+import json
+import asyncio
+
+from .crud import stream_events
+
+EXPORT_FIELDS = [
+    "id", "timestamp", "username", "state",
+    "initial_url", "final_url", "ip", "isp",
+    "device_model", "device_ua",
+]
+
+
+def _write_chunk(f, fmt: str, rows: list):
+    for row in rows:
+        row["timestamp"] = row["timestamp"].isoformat() if row["timestamp"] else None
+    if fmt == "csv":
+        csv.DictWriter(f, fieldnames=EXPORT_FIELDS).writerows(rows)
+    else:
+        f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+async def export_events(path: str, fmt: str = "csv", **filters) -> int:
+    """
+    Выгружает события в gzip-файл path (fmt: "csv" или "jsonl").
+    Фильтры — как у stream_events (date_from, date_to, username, state).
+    Пишет пачками по мере чтения из БД: память не зависит от объёма выгрузки.
+    Сжатие и запись идут в executor, чтобы не блокировать event loop.
+    Возвращает число выгруженных строк.
+    """
+    loop = asyncio.get_running_loop()
+    total = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            csv.writer(f).writerow(EXPORT_FIELDS)
+        async for rows in stream_events(**filters):
+            await loop.run_in_executor(None, _write_chunk, f, fmt, rows)
+            total += len(rows)
+    return total
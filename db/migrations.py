@@ -0,0 +1,183 @@
+# db/migrations.py
+
+import logging
+
+from sqlalchemy import inspect, text, select, update, bindparam
+
+from config import URL_MIGRATION_CHUNK
+from .database import Base
+from .models import Event, Url
+from .urls import normalize_url, url_hash, url_host
+
+log = logging.getLogger(__name__)
+
+# Колонки events, в которых URL раньше хранились текстом
+_LEGACY_URL_COLUMNS = ("initial_url", "final_url")
+
+
+def add_missing_columns(sync_conn):
+    """
+    create_all создаёт только отсутствующие таблицы и не трогает существующие,
+    поэтому новые колонки моделей добавляем вручную через ALTER TABLE ... ADD COLUMN.
+    Подходит для nullable-колонок и колонок с server_default.
+    Заодно создаёт объявленные в моделях индексы, которых ещё нет в БД.
+    """
+    insp = inspect(sync_conn)
+    preparer = sync_conn.dialect.identifier_preparer
+
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = (
+                f"ALTER TABLE {preparer.quote(table.name)} "
+                f"ADD COLUMN {preparer.quote(col.name)} "
+                f"{col.type.compile(dialect=sync_conn.dialect)}"
+            )
+            if col.server_default is not None:
+                default = col.server_default.arg
+                if isinstance(default, str):
+                    default = "'" + default.replace("'", "''") + "'"
+                ddl += f" DEFAULT {getattr(default, 'text', default)}"
+            sync_conn.execute(text(ddl))
+
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+def dedupe_urls(sync_conn):
+    """
+    Склеивает дубли (hash, text) в словаре urls, которые могли появиться
+    до уникального индекса ux_urls_hash_text: ссылки переводятся на строку
+    с наименьшим id, лишние строки удаляются. Вызывается до создания индекса.
+    """
+    insp = inspect(sync_conn)
+    if not insp.has_table("urls"):
+        return
+    dupes = sync_conn.execute(text(
+        "SELECT u.id AS id, k.keep AS keep FROM urls u "
+        "JOIN (SELECT hash, text, MIN(id) AS keep FROM urls "
+        "      GROUP BY hash, text HAVING COUNT(*) > 1) k "
+        "ON u.hash = k.hash AND u.text = k.text "
+        "WHERE u.id <> k.keep"
+    )).all()
+    if not dupes:
+        return
+
+    log.warning("В словаре urls %d дублей — переводим ссылки на первую копию", len(dupes))
+    params = [{"id": r.id, "keep": r.keep} for r in dupes]
+    refs = [("events", "initial_url_id"), ("events", "final_url_id")]
+    if insp.has_table("watch_items"):
+        refs.append(("watch_items", "url_id"))
+    for table, column in refs:
+        sync_conn.execute(text(f"UPDATE {table} SET {column} = :keep WHERE {column} = :id"), params)
+    sync_conn.execute(text("DELETE FROM urls WHERE id = :id"), params)
+
+
+def _has_legacy_url_columns(sync_conn) -> bool:
+    columns = {c["name"] for c in inspect(sync_conn).get_columns("events")}
+    return set(_LEGACY_URL_COLUMNS) <= columns
+
+
+def _ensure_urls(sync_conn, texts: set) -> dict:
+    """
+    Возвращает {text: id} для набора нормализованных URL, добавляя недостающие.
+    """
+    by_hash = {url_hash(t): t for t in texts}
+    found = {}
+    for row in sync_conn.execute(
+        select(Url.id, Url.text).where(Url.hash.in_(list(by_hash)))
+    ):
+        found.setdefault(row.text, row.id)
+
+    missing = [t for t in texts if t not in found]
+    if missing:
+        sync_conn.execute(
+            Url.__table__.insert(),
+            [{"hash": url_hash(t), "text": t, "host": url_host(t)} for t in missing],
+        )
+        for row in sync_conn.execute(
+            select(Url.id, Url.text).where(Url.hash.in_([url_hash(t) for t in missing]))
+        ):
+            found.setdefault(row.text, row.id)
+    return found
+
+
+def _migrate_url_chunk(sync_conn, after_id: int) -> int | None:
+    """
+    Переносит URL одной пачки событий (id > after_id) в словарь urls.
+    Возвращает id последнего обработанного события или None, если их больше нет.
+    """
+    rows = sync_conn.execute(
+        text(
+            "SELECT id, initial_url, final_url FROM events "
+            "WHERE id > :after ORDER BY id LIMIT :n"
+        ),
+        {"after": after_id, "n": URL_MIGRATION_CHUNK},
+    ).all()
+    if not rows:
+        return None
+
+    texts = {normalize_url(u) for r in rows for u in (r.initial_url, r.final_url) if u}
+    ids = _ensure_urls(sync_conn, texts) if texts else {}
+
+    def _id(u):
+        return ids[normalize_url(u)] if u else None
+
+    sync_conn.execute(
+        update(Event.__table__)
+        .where(Event.__table__.c.id == bindparam("event_id"))
+        .values(initial_url_id=bindparam("initial_id"), final_url_id=bindparam("final_id")),
+        [
+            {"event_id": r.id, "initial_id": _id(r.initial_url), "final_id": _id(r.final_url)}
+            for r in rows
+        ],
+    )
+    return rows[-1].id
+
+
+async def needs_url_migration(engine) -> bool:
+    """
+    True, если в events остались текстовые initial_url/final_url.
+    """
+    async with engine.connect() as conn:
+        return await conn.run_sync(_has_legacy_url_columns)
+
+
+async def migrate_event_urls(engine) -> bool:
+    """
+    Переводит старые события с текстовых initial_url/final_url на словарь urls:
+    пачками по URL_MIGRATION_CHUNK, каждая пачка — своей транзакцией,
+    затем удаляет текстовые колонки и (для SQLite) сжимает файл БД.
+
+    Шаг необратимый, поэтому при старте бота не запускается —
+    только через migrate_urls.py (он же делает резервную копию).
+    Повторный запуск после сбоя безопасен. Возвращает True, если миграция была.
+    """
+    if not await needs_url_migration(engine):
+        return False
+
+    last_id, migrated = 0, 0
+    while last_id is not None:
+        async with engine.begin() as conn:
+            last_id = await conn.run_sync(_migrate_url_chunk, last_id)
+        if last_id is not None:
+            migrated += 1
+            log.info("URL перенесены для событий до id=%d", last_id)
+    log.info("Перенос URL завершён: пачек %d", migrated)
+
+    log.warning("Удаляю колонки events.%s", ", events.".join(_LEGACY_URL_COLUMNS))
+    async with engine.begin() as conn:
+        for name in _LEGACY_URL_COLUMNS:
+            await conn.execute(text(f"ALTER TABLE events DROP COLUMN {name}"))
+
+    if engine.dialect.name == "sqlite":
+        log.info("VACUUM базы SQLite")
+        # VACUUM нельзя выполнять внутри транзакции
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("VACUUM"))
+    return True
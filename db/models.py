@@ -6,12 +6,16 @@ import datetime
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
     String,
     DateTime,
+    Date,
+    Float,
     JSON,
     ForeignKey,
     Enum as SQLEnum,
     Boolean,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -44,14 +48,20 @@ class User(Base):
 
 class DeviceOption(Base):
     __tablename__ = "device_options"
+    __table_args__ = (
+        Index("ux_device_options_fingerprint", "fingerprint", unique=True),
+    )
 
-    id       = Column(Integer, primary_key=True, index=True)
-    ua       = Column(String, nullable=False)
-    css_size = Column(JSON, nullable=False)   # [width, height]
-    platform = Column(String, nullable=False)
-    dpr      = Column(Integer, nullable=False)
-    mobile   = Column(Boolean, nullable=False)
-    model    = Column(String, nullable=True)
+    id          = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String, nullable=True)   # db.devices.device_fingerprint(); ключ импорта
+    ua          = Column(String, nullable=False)
+    css_size    = Column(JSON, nullable=False)   # [width, height]
+    platform    = Column(String, nullable=False)
+    dpr         = Column(Float, nullable=False)   # бывает дробным: 2.625, 2.75 …
+    mobile      = Column(Boolean, nullable=False)
+    model       = Column(String, nullable=True)
+    enabled     = Column(Boolean, nullable=False, default=True, server_default="1")
+    seen_at     = Column(DateTime, nullable=True)  # когда профиль последний раз был в каталоге
 
     events = relationship(
         "Event",
@@ -67,21 +77,101 @@ class ProxyLog(Base):
     attempt   = Column(Integer, nullable=False)
     ip        = Column(String, nullable=True)
     city      = Column(String, nullable=True)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    latency_ms = Column(Integer, nullable=True)   # время проверки прокси
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+class Url(Base):
+    """
+    Словарь URL: каждый (нормализованный) URL хранится один раз,
+    события ссылаются на него по id. Поиск — по 64-битному хэшу.
+    """
+    __tablename__ = "urls"
+    __table_args__ = (
+        # один URL — одна строка даже при параллельном интернировании
+        Index("ux_urls_hash_text", "hash", "text", unique=True),
+    )
+
+    id   = Column(Integer, primary_key=True, index=True)
+    hash = Column(BigInteger, nullable=False, index=True)   # db.urls.url_hash(text)
+    text = Column(String, nullable=False)
+    host = Column(String, nullable=True, index=True)
 
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        # «во что раскрывалась эта ссылка раньше» — точечный запрос по индексу
+        Index("ix_events_initial_url_id_timestamp", "initial_url_id", "timestamp"),
+    )
 
     id               = Column(Integer, primary_key=True, index=True)
     user_id          = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     device_option_id = Column(Integer, ForeignKey("device_options.id", ondelete="SET NULL"), nullable=False, index=True)
     state            = Column(String, nullable=False)
-    initial_url      = Column(String, nullable=False)
-    final_url        = Column(String, nullable=False)
+    initial_url_id   = Column(Integer, ForeignKey("urls.id"), nullable=True)   # NULL — ссылки не было
+    final_url_id     = Column(Integer, ForeignKey("urls.id"), nullable=True, index=True)
     ip               = Column(String, nullable=True)
     isp              = Column(String, nullable=True)
     timestamp        = Column(DateTime, default=datetime.datetime.utcnow)
 
     user          = relationship("User", back_populates="events")
     device_option = relationship("DeviceOption", back_populates="events")
+    initial_url   = relationship("Url", foreign_keys=[initial_url_id])
+    final_url     = relationship("Url", foreign_keys=[final_url_id])
+
+
+class CrawlStat(Base):
+    __tablename__ = "crawl_stats"
+
+    id                  = Column(Integer, primary_key=True, index=True)
+    event_id            = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), nullable=False, index=True)
+    duration_ms         = Column(Integer, nullable=False)
+    chrome_peak_rss_kb  = Column(Integer, nullable=True)   # дерево процессов Chrome
+    backend_peak_rss_kb = Column(Integer, nullable=True)   # процесс бота с mitm-бэкендом
+    hops                = Column(JSON, nullable=False)     # [{"url": str, "status": int}, ...]
+    timestamp           = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+# --- Агрегаты по событиям (обновляются инкрементально в create_event) ---
+
+class DailyHostStat(Base):
+    __tablename__ = "daily_host_stats"
+
+    day   = Column(Date, primary_key=True)
+    host  = Column(String, primary_key=True)   # хост итогового URL
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyIspStat(Base):
+    __tablename__ = "daily_isp_stats"
+
+    day   = Column(Date, primary_key=True)
+    isp   = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyStateStat(Base):
+    __tablename__ = "daily_state_stats"
+
+    day   = Column(Date, primary_key=True)
+    state = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class WatchItem(Base):
+    """
+    Ссылка из списка наблюдения: периодически раскрывается в фоне,
+    пользователь получает уведомление, если итоговый URL изменился.
+    """
+    __tablename__ = "watch_items"
+
+    id               = Column(Integer, primary_key=True, index=True)
+    user_id          = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    url_id           = Column(Integer, ForeignKey("urls.id"), nullable=False)
+    device_class     = Column(String, nullable=True)   # ios / android / desktop; NULL — любой
+    interval_minutes = Column(Integer, nullable=False)
+    next_check_at    = Column(DateTime, nullable=False, index=True)
+    created_at       = Column(DateTime, default=datetime.datetime.utcnow)
+
+    url = relationship("Url")
@@ -0,0 +1,66 @@
+# db/urls.py
+
+import hashlib
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+
+def normalize_url(url: str) -> str:
+    """
+    Каноничный вид URL для словаря: без пробелов по краям,
+    схема и хост в нижнем регистре; путь, query и фрагмент не трогаем.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    return urlunsplit(parts._replace(scheme=parts.scheme.lower(), netloc=parts.netloc.lower()))
+
+
+def url_hash(text: str) -> int:
+    """
+    64-битный хэш нормализованного URL (знаковый — влезает в BIGINT/INTEGER).
+    """
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def url_host(url: str) -> str | None:
+    """
+    Хост URL в нижнем регистре (без порта и www.), None — если его нет.
+    """
+    if not url:
+        return None
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    return host[4:] if host.startswith("www.") else host
+
+
+class LruCache:
+    """
+    Простой LRU-кэш фиксированного размера поверх OrderedDict.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
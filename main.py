@@ -1,11 +1,34 @@
 # main.py
 
 import asyncio
+import datetime
 from telegram.ext import ApplicationBuilder
-from config import TELEGRAM_TOKEN
+from config import TELEGRAM_TOKEN, PROXY_HEALTH_WINDOW
 from db.database import init_db
 from db.seed import seed_initial_admins
+from db.crud import list_proxy_logs_since, rebuild_event_aggregates
+from crawler.health import proxy_health
+from crawler.engines import crawl_engine
 from bot.handlers import register_handlers
+from bot.outbox import outbox
+from bot.diagnostics import loop_monitor
+from bot.watcher import watch_scheduler
+
+
+async def on_startup(app):
+    # фоновые задачи, которым нужен уже запущенный event loop приложения
+    await outbox.start(app)        # очередь исходящих сообщений
+    await loop_monitor.start()     # замер задержки event loop
+    await crawl_engine.start()     # общий браузер (для playwright-движка)
+    await watch_scheduler.start(app)  # фоновые проверки списков наблюдения
+
+
+async def on_shutdown(app):
+    await watch_scheduler.stop(app)
+    await crawl_engine.stop()
+    await loop_monitor.stop()
+    await outbox.stop(app)
+
 
 def main():
     # создаём и устанавливаем собственный event loop
@@ -18,8 +41,24 @@ def main():
     # 2) сидирование начальных админов из конфига (pending → они будут активированы при /start)
     loop.run_until_complete(seed_initial_admins())
 
-    # 3) сборка и запуск бота
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    # 3) заполняем агрегаты статистики по старой истории событий (однократно)
+    loop.run_until_complete(rebuild_event_aggregates())
+
+    # 4) восстанавливаем окно здоровья прокси-провайдера из недавних ProxyLog
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=PROXY_HEALTH_WINDOW)
+    proxy_health.seed(loop.run_until_complete(list_proxy_logs_since(since)))
+
+    # 5) сборка и запуск бота
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        # апдейты обрабатываются параллельно: иначе обходы ссылок шли бы строго
+        # по одному и crawl_controller никогда не упирался бы в свой лимит
+        .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     register_handlers(app)
 
     print("🤖 Бот запущен, ожидаю сообщений...")
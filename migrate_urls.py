@@ -0,0 +1,58 @@
+#migrate_urls.py
+"""
+Однократный перенос текстовых URL старых событий в словарь urls.
+
+    python migrate_urls.py                # копия SQLite-файла рядом, затем миграция
+    python migrate_urls.py --no-backup    # без копии (для не-SQLite БД копию делай сам)
+
+Миграция удаляет колонки events.initial_url / events.final_url и сжимает
+SQLite-файл (VACUUM) — откатить её можно только из резервной копии.
+Пока она не выполнена, бот не запускается.
+"""
+
+import os
+import sys
+import shutil
+import asyncio
+import logging
+import argparse
+import datetime
+
+from db.database import engine, create_schema
+from db.migrations import needs_url_migration, migrate_event_urls
+
+
+def backup_sqlite() -> str:
+    path = engine.url.database
+    backup = f"{path}.bak-{datetime.datetime.now():%Y%m%d_%H%M%S}"
+    shutil.copy2(path, backup)
+    return backup
+
+
+async def run(no_backup: bool):
+    await create_schema()
+    if not await needs_url_migration(engine):
+        print("Миграция не нужна: events уже ссылаются на словарь urls.")
+        return
+
+    if not no_backup:
+        if engine.dialect.name != "sqlite" or not os.path.isfile(engine.url.database or ""):
+            sys.exit("Резервную копию этой БД сделай сам и запусти с --no-backup.")
+        print(f"💾 Резервная копия: {backup_sqlite()}")
+
+    await migrate_event_urls(engine)
+    print("✅ URL событий перенесены в словарь, старые колонки удалены.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос текстовых URL событий в словарь urls")
+    parser.add_argument("--no-backup", action="store_true",
+                        help="не копировать SQLite-файл перед миграцией")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(run(args.no_backup))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,28 @@
 #populate_devices.py
+"""
+Импорт каталога профилей устройств в device_options.
 
+    python populate_devices.py                      # встроенные DEVICE_DATA
+    python populate_devices.py catalog.jsonl        # JSONL: по объекту на строку
+    python populate_devices.py catalog.csv          # CSV: ua,width,height,platform,dpr,mobile,model
+
+Каталог читается потоково и пишется пачками INSERT ... ON CONFLICT по fingerprint,
+поэтому память не зависит от размера файла. Профили, которых нет в каталоге,
+отключаются (enabled=false), а не удаляются — ссылки из events остаются целыми.
+"""
+
+import csv
+import json
 import asyncio
-from sqlalchemy import delete
-from db.database import init_db, AsyncSessionLocal
-from db.models import DeviceOption
+import argparse
+import datetime
+from itertools import islice
+
+from db.database import init_db
+from db.devices import validate_device
+from db.crud import backfill_device_fingerprints, upsert_devices, disable_unseen_devices
+
+BATCH_SIZE = 1000
 
 # Здесь — ваши данные
 DEVICE_DATA = {
@@ -49,32 +68,72 @@ DEVICE_DATA = {
     }
 }
 
+
+def iter_records(path: str | None):
+    """
+    Отдаёт сырые записи каталога по одной: (номер строки, dict).
+    """
+    if path is None:
+        yield from enumerate(DEVICE_DATA.values(), 1)
+        return
+
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            for lineno, row in enumerate(csv.DictReader(f), 2):
+                row["css_size"] = [row.pop("width", None), row.pop("height", None)]
+                yield lineno, row
+        else:
+            for lineno, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield lineno, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield lineno, e
+
+
+def iter_valid(records, seen_at: datetime.datetime, stats: dict):
+    for lineno, record in records:
+        try:
+            if isinstance(record, Exception):
+                raise ValueError(str(record))
+            device = validate_device(record)
+        except ValueError as e:
+            stats["invalid"] += 1
+            print(f"⚠️  строка {lineno}: {e}")
+            continue
+        device["enabled"] = True
+        device["seen_at"] = seen_at
+        stats["valid"] += 1
+        yield device
+
+
 async def main():
+    parser = argparse.ArgumentParser(description="Импорт каталога профилей устройств")
+    parser.add_argument("catalog", nargs="?", help="файл .jsonl или .csv (по умолчанию — DEVICE_DATA)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="размер пачки upsert")
+    parser.add_argument("--keep-missing", action="store_true",
+                        help="не отключать профили, которых нет в каталоге")
+    args = parser.parse_args()
+
     # 1) Создаём таблицы, если ещё не созданы
     await init_db()
+    await backfill_device_fingerprints()
+
+    # 2) Потоково читаем каталог и пишем пачками
+    seen_at = datetime.datetime.utcnow()
+    stats = {"valid": 0, "invalid": 0}
+    devices = iter_valid(iter_records(args.catalog), seen_at, stats)
+    while batch := list(islice(devices, args.batch)):
+        await upsert_devices(batch)
+
+    # 3) Отключаем профили, которых не было в каталоге
+    disabled = 0 if args.keep_missing else await disable_unseen_devices(seen_at)
 
-    async with AsyncSessionLocal() as session:
-        # (опционально) очищаем старые записи
-        await session.execute(delete(DeviceOption))
-
-        # 2) Добавляем каждую запись
-        for id_str, opt in DEVICE_DATA.items():
-            device = DeviceOption(
-                id           = int(id_str),
-                ua           = opt["ua"],
-                css_size     = opt["css_size"],
-                platform     = opt["platform"],
-                # модель БД хранит dpr как Integer, поэтому приводим
-                dpr          = int(opt["dpr"]),
-                mobile       = 1 if opt["mobile"] else 0,
-                model        = opt.get("model")
-            )
-            session.add(device)
-
-        # 3) Фиксируем изменения
-        await session.commit()
-
-    print("✔️  Всё готово — данные записаны в таблицу device_options")
+    print(
+        f"✔️  Готово: записано {stats['valid']}, пропущено {stats['invalid']}, "
+        f"отключено {disabled} профилей в device_options"
+    )
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,37 @@
+# tests/conftest.py
+
+import os
+import asyncio
+import tempfile
+
+import pytest
+
+# тесты не должны трогать рабочую ./app.db
+os.environ.setdefault(
+    "DATABASE_URL",
+    f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}",
+)
+
+
+@pytest.fixture
+def fresh_db():
+    """
+    Пустая схема в тестовой БД и пустой кэш URL — для тестов, которым
+    важны точные счётчики.
+    """
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("aiosqlite")
+    from db import crud
+    from db.database import Base, engine, create_schema
+
+    async def reset():
+        import db.models  # noqa: F401
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+        await create_schema()
+        await engine.dispose()
+
+    asyncio.run(reset())
+    crud._url_cache.clear()
+    yield
+    asyncio.run(engine.dispose())
@@ -0,0 +1,78 @@
+# tests/test_aggregates.py
+
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiosqlite")
+
+from db import crud
+from db.database import unit_of_work
+from db.models import Event
+
+
+async def _user_id() -> int:
+    async with unit_of_work():
+        user = await crud.invite_user("stats", "User", None)
+    return user.id
+
+
+async def _old_event(db, user_id, state, final_url, isp, timestamp):
+    # событие из истории до появления агрегатов: счётчики не трогаем
+    db.add(Event(
+        user_id=user_id, state=state, device_option_id=0,
+        initial_url_id=await crud._intern_url(db, "https://in.example/"),
+        final_url_id=await crud._intern_url(db, final_url),
+        ip=None, isp=isp, timestamp=timestamp,
+    ))
+
+
+def test_backfill_then_live_updates(fresh_db):
+    now = datetime.datetime.utcnow()
+    yesterday = now - datetime.timedelta(days=1)
+
+    async def main():
+        user_id = await _user_id()
+        async with unit_of_work() as db:
+            await _old_event(db, user_id, "success", "https://www.shop.example/a", "ISP-1", now)
+            await _old_event(db, user_id, "watch", "https://shop.example/b", "ISP-1", now)
+            await _old_event(db, user_id, "proxy error", "", None, now)
+            await _old_event(db, user_id, "success", "https://old.example/", "ISP-2", yesterday)
+
+        first = await crud.rebuild_event_aggregates()
+        second = await crud.rebuild_event_aggregates()
+
+        # живые события идут через ON CONFLICT … count + excluded.count
+        async with unit_of_work():
+            for _ in range(2):
+                await crud.create_event(user_id=user_id, state="success", device_option_id=0,
+                                        initial_url="https://in.example/",
+                                        final_url="https://WWW.shop.example/c",
+                                        ip=None, isp="ISP-1")
+
+        async with unit_of_work():
+            return first, second, await crud.get_global_stats(1), await crud.get_global_stats(2)
+
+    first, second, today, two_days = asyncio.run(main())
+
+    # заполнение — только один раз
+    assert (first, second) == (True, False)
+
+    # days=1 — только сегодня (since = сегодня - (days - 1))
+    assert today["total"] == 5
+    # перепроверки из списков наблюдения считаются успешными
+    assert today["success"] == 4
+    assert dict(today["states"]) == {"success": 3, "watch": 1, "proxy error": 1}
+    # www. срезан — хост один
+    assert today["hosts"] == [("shop.example", 4)]
+    assert today["isps"] == [("ISP-1", 4)]
+
+    assert two_days["total"] == 6
+    assert two_days["success"] == 5
+    assert dict(two_days["hosts"]) == {"shop.example": 4, "old.example": 1}
+
+
+def test_backfill_skips_empty_history(fresh_db):
+    assert asyncio.run(crud.rebuild_event_aggregates()) is False
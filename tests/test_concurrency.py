@@ -0,0 +1,59 @@
+# tests/test_concurrency.py
+
+import asyncio
+
+import pytest
+
+from crawler import concurrency
+from crawler.concurrency import CrawlController
+
+
+@pytest.fixture
+def host(monkeypatch):
+    state = {"available_mb": 100_000, "load": 0.1}
+    monkeypatch.setattr(concurrency, "host_available_mb", lambda: state["available_mb"])
+    monkeypatch.setattr(concurrency, "host_load_per_cpu", lambda: state["load"])
+    return state
+
+
+def _crawl_burst(controller, n: int, peak: dict):
+    async def crawl():
+        async with controller.slot():
+            peak["active"] = max(peak.get("active", 0), controller.active)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(crawl() for _ in range(n)))
+
+    asyncio.run(main())
+
+
+def test_limit_grows_under_saturating_load(host):
+    controller = CrawlController()
+    start = controller.limit
+    peak = {}
+    _crawl_burst(controller, 20, peak)
+    assert controller.limit > start
+    assert peak["active"] > start
+    assert controller.active == 0
+
+
+def test_limit_halves_when_memory_is_tight(host):
+    controller = CrawlController()
+    controller.limit = 8
+    host["available_mb"] = 0
+    _crawl_burst(controller, 1, {})
+    assert controller.limit == 4
+
+
+def test_background_slot_leaves_room_for_interactive(host):
+    controller = CrawlController()
+    controller.limit = 2
+    controller.active = 1
+    assert controller._can_admit(background=False)
+    assert not controller._can_admit(background=True)
+
+    controller.limit = 1
+    controller.active = 0
+    # при единственном слоте фоновый обход всё же допускается
+    assert controller._can_admit(background=True)
@@ -0,0 +1,42 @@
+# tests/test_devices.py
+
+import pytest
+
+from db.devices import validate_device, device_fingerprint
+
+RECORD = {
+    "ua": " Mozilla/5.0 (iPhone) ",
+    "css_size": ["393", 852],
+    "platform": "iPhone",
+    "dpr": "3",
+    "mobile": "yes",
+    "model": "Apple iPhone 15 Pro",
+}
+
+
+def test_valid_record_is_normalized():
+    device = validate_device(RECORD)
+    assert device["ua"] == "Mozilla/5.0 (iPhone)"
+    assert device["css_size"] == [393, 852]
+    assert device["dpr"] == 3.0
+    assert device["mobile"] is True
+    assert device["fingerprint"] == device_fingerprint(device)
+
+
+def test_fingerprint_ignores_model():
+    a = validate_device(RECORD)
+    b = validate_device({**RECORD, "model": "другое имя"})
+    assert a["fingerprint"] == b["fingerprint"]
+
+
+@pytest.mark.parametrize("patch", [
+    {"ua": ""},
+    {"css_size": [0, 800]},
+    {"css_size": "393x852"},
+    {"dpr": "abc"},
+    {"dpr": 10},
+    {"mobile": "maybe"},
+])
+def test_invalid_record(patch):
+    with pytest.raises(ValueError):
+        validate_device({**RECORD, **patch})
@@ -0,0 +1,60 @@
+# tests/test_diagnostics.py
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.diagnostics import LoopLagMonitor, executor_gauge, sample_profile
+
+
+def test_executor_gauge():
+    assert executor_gauge(None) == {"threads": 0, "max": 0, "queued": 0}
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        pool.submit(time.sleep, 0.01).result()
+        gauge = executor_gauge(pool)
+    assert gauge["max"] == 2
+    assert gauge["threads"] >= 1
+
+
+def test_lag_snapshot_percentiles():
+    monitor = LoopLagMonitor()
+    assert monitor.snapshot()["samples"] == 0
+    monitor.lags.extend(i / 1000 for i in range(100))
+    monitor.max_lag = 0.099
+    snap = monitor.snapshot()
+    assert snap["samples"] == 100
+    assert snap["p50_ms"] == 50
+    assert snap["p99_ms"] == 99
+
+
+def _busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_profile_sees_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_worker, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        collapsed = sample_profile(0.1)
+    finally:
+        stop.set()
+        worker.join()
+    assert any(line.startswith("busy-worker;") and "_busy_worker" in line
+               for line in collapsed.splitlines())
+
+
+def test_start_resets_heartbeat():
+    monitor = LoopLagMonitor()
+    # долгий старт бота между созданием монитора и start()
+    monitor._heartbeat -= 30
+
+    async def main():
+        await monitor.start()
+        heartbeat = monitor._heartbeat
+        await monitor.stop()
+        return heartbeat
+
+    assert time.monotonic() - asyncio.run(main()) < 1
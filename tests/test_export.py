@@ -0,0 +1,57 @@
+# tests/test_export.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiosqlite")
+
+from db import crud
+from db.database import unit_of_work
+from db.models import UserStatus
+
+
+async def _seed_events(n: int) -> int:
+    async with unit_of_work():
+        user = await crud.invite_user("exporter", "Admin", None)
+        user.status = UserStatus.active
+        for i in range(n):
+            await crud.create_event(user_id=user.id, state="success", device_option_id=0,
+                                    initial_url=f"https://a.example/{i}",
+                                    final_url=f"https://b.example/{i}", ip=None, isp=None)
+    return user.id
+
+
+def test_stream_events_reads_all_rows_in_keyset_chunks(fresh_db):
+    async def main():
+        await _seed_events(5)
+        return [chunk async for chunk in crud.stream_events(chunk_size=2)]
+
+    chunks = asyncio.run(main())
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    ids = [row["id"] for c in chunks for row in c]
+    assert ids == sorted(ids) and len(set(ids)) == 5
+    assert chunks[0][0]["initial_url"] == "https://a.example/0"
+
+
+def test_events_can_be_written_during_export(fresh_db):
+    async def main():
+        user_id = await _seed_events(4)
+        exported = 0
+        async for rows in crud.stream_events(chunk_size=2):
+            exported += len(rows)
+            if exported == 2:
+                # выгрузка посередине — обход другого апдейта должен записаться сразу
+                async def write():
+                    async with unit_of_work():
+                        await crud.create_event(user_id=user_id, state="success",
+                                                device_option_id=0,
+                                                initial_url="https://c.example/",
+                                                final_url="https://d.example/",
+                                                ip=None, isp=None)
+                await asyncio.wait_for(write(), timeout=3)
+        return exported
+
+    # событие, записанное во время выгрузки, попадает в следующую пачку
+    assert asyncio.run(main()) == 5
@@ -0,0 +1,35 @@
+# tests/test_export_args.py
+
+import datetime
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("seleniumwire")
+
+from bot.handlers import parse_export_args
+
+
+def test_defaults():
+    assert parse_export_args([]) == ("csv", {})
+
+
+def test_all_filters():
+    fmt, export_filters = parse_export_args(
+        ["jsonl", "from=2024-01-01", "to=2024-01-31", "user=@Alice", "state=proxy_error"]
+    )
+    assert fmt == "jsonl"
+    assert export_filters == {
+        "date_from": datetime.datetime(2024, 1, 1),
+        # to= включительно
+        "date_to": datetime.datetime(2024, 2, 1),
+        "username": "alice",
+        "state": "proxy error",
+    }
+
+
+@pytest.mark.parametrize("arg", ["xml", "from=", "from=01.01.2024", "limit=5"])
+def test_bad_argument(arg):
+    with pytest.raises(ValueError):
+        parse_export_args([arg])
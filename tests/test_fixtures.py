@@ -0,0 +1,193 @@
+# tests/test_fixtures.py
+
+import os
+import ssl
+import gzip
+import json
+import time
+import base64
+import datetime
+import http.client
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from crawler.fixtures import (
+    FixtureReplayer,
+    FixtureRecorder,
+    FixtureServer,
+    save_fixture,
+    load_fixture,
+)
+
+
+def _entry(url, start_ms=0, wait_ms=0, status=200, body=b"ok", method="GET"):
+    return {
+        "method": method,
+        "url": url,
+        "request_headers": [],
+        "status": status,
+        "reason": "OK",
+        "response_headers": [["Content-Type", "text/html"]],
+        "body": base64.b64encode(body).decode("ascii"),
+        "start_ms": start_ms,
+        "wait_ms": wait_ms,
+    }
+
+
+def _fixture(*entries):
+    return {"url": "https://a.example/", "final_url": "https://b.example/",
+            "device": {}, "ip_info": {"query": "1.2.3.4"}, "entries": list(entries)}
+
+
+def test_repeated_requests_follow_recorded_order():
+    replayer = FixtureReplayer(_fixture(
+        _entry("https://a.example/", status=302, body=b"1"),
+        _entry("https://a.example/", status=200, body=b"2"),
+    ), scale=0)
+    statuses = [replayer.respond("GET", "https://a.example/")[0] for _ in range(3)]
+    # последний ответ повторяется
+    assert statuses == [302, 200, 200]
+
+
+def test_unknown_request_is_404_and_counted():
+    replayer = FixtureReplayer(_fixture(), scale=0)
+    assert replayer.respond("GET", "https://missing.example/")[0] == 404
+    assert replayer.misses == 1
+
+
+def test_delay_follows_recorded_timeline():
+    replayer = FixtureReplayer(_fixture(), scale=1.0)
+    first = _entry("https://a.example/", start_ms=0, wait_ms=100)
+    late = _entry("https://a.example/x.js", start_ms=500, wait_ms=100)
+
+    assert replayer._delay(first, now=10.0) == pytest.approx(0.1)
+    # браузер запросил раньше, чем в записи, — ответ придёт в записанный момент
+    assert replayer._delay(late, now=10.2) == pytest.approx(0.4)
+    # запросил позже — ждём хотя бы записанное wait_ms
+    assert replayer._delay(late, now=11.0) == pytest.approx(0.1)
+
+
+def test_scale_zero_disables_delays():
+    replayer = FixtureReplayer(_fixture(), scale=0)
+    assert replayer._delay(_entry("https://a.example/", start_ms=500, wait_ms=900), now=1.0) == 0
+
+
+def test_load_rejects_unknown_version(tmp_path):
+    path = str(tmp_path / "f.json.gz")
+    save_fixture(path, "https://a.example/", "https://b.example/", {}, {}, [])
+    assert load_fixture(path)["entries"] == []
+
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"version": 999}, f)
+    with pytest.raises(ValueError):
+        load_fixture(path)
+
+
+class FakeWireRequest:
+    """
+    Запрос selenium-wire: method, url, headers, date и response.
+    """
+
+    def __init__(self, url, date, headers=None, status=200):
+        self.method = "GET"
+        self.url = url
+        self.headers = headers or {}
+        self.date = date
+        self.response = FakeWireResponse(status, date)
+
+    def copy(self):
+        # в response_interceptor приходит новая копия запроса с датой ответа
+        req = FakeWireRequest(self.url, self.response.date, self.headers)
+        req.response = self.response
+        return req
+
+
+class FakeWireResponse:
+    def __init__(self, status, date):
+        self.status_code = status
+        self.reason = "OK"
+        self.headers = {}
+        self.body = b""
+        self.date = date + datetime.timedelta(milliseconds=20)
+
+
+def test_recorder_keeps_hops_evicted_from_capped_storage(tmp_path):
+    cap = 5
+    t0 = datetime.datetime(2024, 1, 1)
+    recorder = FixtureRecorder()
+    storage = []
+    requests = [
+        FakeWireRequest("http://a.example/", t0, {"Upgrade-Insecure-Requests": "1"}, status=302),
+        FakeWireRequest("https://b.example/", t0 + datetime.timedelta(milliseconds=30),
+                        {"Sec-Fetch-Dest": "document"}),
+    ] + [
+        FakeWireRequest(f"https://b.example/{i}.js", t0 + datetime.timedelta(milliseconds=40 + i))
+        for i in range(20)
+    ]
+    for req in requests:
+        recorder.request_interceptor(req)
+        # InMemoryRequestStorage: при переполнении вытесняется самый старый
+        storage.append(req)
+        del storage[:-cap]
+        recorder.response_interceptor(req.copy(), req.response)
+
+    assert "https://b.example/" not in {r.url for r in storage}
+
+    path = str(tmp_path / "f.json.gz")
+    save_fixture(path, "http://a.example/", "https://b.example/", {}, {},
+                 recorder.requests(storage))
+    entries = load_fixture(path)["entries"]
+    assert [e["url"] for e in entries[:2]] == ["http://a.example/", "https://b.example/"]
+    assert entries[0]["status"] == 302
+    # время запроса — из request_interceptor, а не момент ответа
+    assert entries[1]["start_ms"] == 30 and entries[1]["wait_ms"] == 20
+    assert len(entries) == 2 + cap
+
+
+def _tls_files():
+    spec = importlib.util.find_spec("seleniumwire")
+    if spec is None:
+        pytest.skip("нужен сертификат selenium-wire")
+    base = os.path.dirname(spec.origin)
+    return os.path.join(base, "ca.crt"), os.path.join(base, "ca.key")
+
+
+def _get(server, url):
+    host, port = server.url[len("http://"):].split(":")
+    conn = http.client.HTTPConnection(host, int(port), timeout=5)
+    conn.request("GET", url)
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+
+
+def test_server_answers_parallel_requests_independently():
+    replayer = FixtureReplayer(_fixture(
+        _entry("http://a.example/1.js", start_ms=0, wait_ms=300, body=b"one"),
+        _entry("http://a.example/2.js", start_ms=0, wait_ms=300, body=b"two"),
+    ))
+    with FixtureServer(replayer, *_tls_files()) as server:
+        started = time.monotonic()
+        with ThreadPoolExecutor(2) as pool:
+            results = list(pool.map(lambda u: _get(server, u),
+                                    ["http://a.example/1.js", "http://a.example/2.js"]))
+        elapsed = time.monotonic() - started
+
+    assert results == [(200, b"one"), (200, b"two")]
+    # в записи запросы шли параллельно — при воспроизведении тоже
+    assert elapsed < 0.55
+
+
+def test_server_terminates_tls_inside_connect():
+    replayer = FixtureReplayer(_fixture(_entry("https://a.example/x?y=1", body=b"secure")), scale=0)
+    with FixtureServer(replayer, *_tls_files()) as server:
+        host, port = server.url[len("http://"):].split(":")
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        conn = http.client.HTTPSConnection(host, int(port), context=ctx, timeout=5)
+        conn.set_tunnel("a.example", 443)
+        conn.request("GET", "/x?y=1")
+        resp = conn.getresponse()
+        assert (resp.status, resp.read()) == (200, b"secure")
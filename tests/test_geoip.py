@@ -0,0 +1,52 @@
+# tests/test_geoip.py
+
+import pytest
+
+from crawler import geoip
+
+
+class FakeReader:
+    def __init__(self, records):
+        self.records = records
+        self.calls = 0
+
+    def get(self, ip):
+        self.calls += 1
+        return self.records.get(ip)
+
+
+@pytest.fixture
+def city_db(monkeypatch):
+    db = FakeReader({})
+    monkeypatch.setattr(geoip, "_reader", lambda path: db if path == geoip.GEOIP_CITY_DB else None)
+    geoip._cache.clear()
+    yield db
+    geoip._cache.clear()
+
+
+def _city(name):
+    return {"city": {"names": {"en": name}}}
+
+
+def test_lookup_caches_hits(city_db):
+    city_db.records["1.2.3.4"] = _city("Moscow")
+    assert geoip.lookup("1.2.3.4") == {"query": "1.2.3.4", "city": "Moscow", "isp": None}
+    assert geoip.lookup("1.2.3.4")["city"] == "Moscow"
+    assert city_db.calls == 1
+
+
+def test_lookup_does_not_cache_misses(city_db):
+    assert geoip.lookup("1.2.3.4") is None
+    city_db.records["1.2.3.4"] = _city("Moscow")
+    assert geoip.lookup("1.2.3.4")["city"] == "Moscow"
+
+
+def test_lookup_without_city_is_a_miss(city_db):
+    city_db.records["1.2.3.4"] = {"country": {"iso_code": "RU"}}
+    assert geoip.lookup("1.2.3.4") is None
+
+
+def test_lookup_without_database(monkeypatch):
+    monkeypatch.setattr(geoip, "_reader", lambda path: None)
+    geoip._cache.clear()
+    assert geoip.lookup("1.2.3.4") is None
@@ -0,0 +1,195 @@
+# tests/test_handlers.py
+
+import gzip
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("seleniumwire")
+
+from telegram.error import RetryAfter
+
+from bot import handlers
+from bot.outbox import Outbox
+from crawler.concurrency import CrawlController
+from crawler.redirector import ProxyAcquireError, ProxyCircuitOpenError
+from db.devices import DEVICE_CLASSES
+from db import crud
+from db.database import unit_of_work
+
+
+@pytest.fixture(autouse=True)
+def outbox(monkeypatch):
+    # своя очередь на тест: singleton привязан к event loop первого запуска
+    box = Outbox()
+    monkeypatch.setattr(handlers, "outbox", box)
+    return box
+
+
+async def _admin(tg_id: int = 100):
+    async with unit_of_work():
+        await crud.invite_user("admin", "Admin", None)
+        await crud.activate_user(tg_id, "admin")
+
+
+def _update(tg_id: int, sent: list, texts: list):
+    attempts = []
+
+    async def reply_document(document, filename=None, caption=None):
+        attempts.append(filename)
+        # как InputFile в PTB: содержимое читается при каждом вызове
+        data = document.read() if hasattr(document, "read") else document
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+        sent.append(data)
+
+    async def reply_text(text, **kwargs):
+        texts.append(text)
+
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=tg_id),
+        effective_chat=SimpleNamespace(id=tg_id),
+        message=SimpleNamespace(reply_text=reply_text, reply_document=reply_document),
+    )
+
+
+async def _run(outbox, handler, update, args):
+    await outbox.start()
+    try:
+        await handlers.in_unit_of_work(handler)(update, SimpleNamespace(args=args, user_data={}))
+        # profile_cmd не ждёт отправки — даём outbox доставить
+        for _ in range(100):
+            if not outbox._jobs and not outbox._sending:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await outbox.stop()
+
+
+def test_export_retry_after_resends_whole_file(fresh_db, outbox):
+    sent, texts = [], []
+
+    async def main():
+        await _admin()
+        await _run(outbox, handlers.export_cmd, _update(100, sent, texts), [])
+
+    asyncio.run(main())
+    assert len(sent) == 1
+    assert gzip.decompress(sent[0]).startswith(b"id,timestamp,")
+
+
+def test_profile_retry_after_resends_stacks(fresh_db, outbox, monkeypatch):
+    monkeypatch.setattr(handlers, "sample_profile", lambda seconds: "MainThread;main 3\n")
+    sent, texts = [], []
+
+    async def main():
+        await _admin()
+        await _run(outbox, handlers.profile_cmd, _update(100, sent, texts), ["1"])
+
+    asyncio.run(main())
+    assert sent == [b"MainThread;main 3\n"]
+
+
+DEVICE = {"id": 1, "model": "Pixel", "ua": "UA", "css_size": [412, 915],
+          "platform": "Linux armv8l", "dpr": 2.625, "mobile": True}
+
+
+def _link_update(tg_id: int, url: str, texts: list):
+    async def reply_text(text, **kwargs):
+        texts.append(text)
+
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=tg_id, username="admin"),
+        effective_chat=SimpleNamespace(id=tg_id),
+        message=SimpleNamespace(text=url, message_id=1, reply_text=reply_text),
+    )
+
+
+def test_link_acquires_proxy_outside_crawl_slot(fresh_db, outbox, monkeypatch):
+    controller = CrawlController()
+    monkeypatch.setattr(handlers, "crawl_controller", controller)
+
+    async def random_device(device_class=None):
+        return DEVICE
+    monkeypatch.setattr(handlers, "get_random_device", random_device)
+
+    active_during_acquire = []
+    proxy = ("http://u:p@proxy:1", {"query": "1.2.3.4", "isp": "ISP"})
+
+    def acquire():
+        active_during_acquire.append(controller.active)
+        return proxy, [{"attempt": 1, "ip": "1.2.3.4", "city": "Moscow", "latency_ms": 5}]
+    monkeypatch.setattr(handlers, "acquire_proxy", acquire)
+
+    class Engine:
+        async def fetch(self, raw_url, device, *, proxy=None, replay=None):
+            assert controller.active == 1
+            self.proxy = proxy
+            return raw_url, "https://b.example/", "1.2.3.4", "ISP", device, [], {
+                "duration_ms": 10, "chrome_peak_rss_kb": None,
+                "backend_peak_rss_kb": None, "hops": [],
+            }
+    engine = Engine()
+    monkeypatch.setattr(handlers, "crawl_engine", engine)
+
+    texts = []
+
+    async def main():
+        await _admin()
+        await _run(outbox, handlers.handle_message, _link_update(100, "https://a.example/", texts), [])
+        async with unit_of_work():
+            return await crud.get_global_stats(1)
+
+    stats = asyncio.run(main())
+    assert active_during_acquire == [0]
+    assert engine.proxy == proxy
+    assert stats["success"] == 1
+    assert "https://b.example/" in texts[-1]
+
+
+def test_profile_duration_is_clamped_in_reply(fresh_db, outbox, monkeypatch):
+    requested = []
+
+    def profile(seconds):
+        requested.append(seconds)
+        return ""
+    monkeypatch.setattr(handlers, "sample_profile", profile)
+    sent, texts = [], []
+
+    async def main():
+        await _admin()
+        await _run(outbox, handlers.profile_cmd, _update(100, sent, texts), ["100000"])
+
+    asyncio.run(main())
+    assert requested == [handlers.DIAG_PROFILE_MAX_S]
+    assert f"({handlers.DIAG_PROFILE_MAX_S} с)" in texts[0]
+
+
+@pytest.mark.parametrize("error, state", [
+    (ProxyCircuitOpenError(), "proxy circuit open"),
+    (ProxyAcquireError([{"attempt": 1, "ip": None, "city": None, "latency_ms": 5}]), "proxy error"),
+])
+def test_compare_records_proxy_failures(fresh_db, outbox, monkeypatch, error, state):
+    async def random_device(device_class=None):
+        return {**DEVICE, "id": DEVICE_CLASSES.index(device_class) + 1}
+    monkeypatch.setattr(handlers, "get_random_device", random_device)
+
+    async def fanout(raw_url, devices):
+        raise error
+    monkeypatch.setattr(handlers, "fetch_redirect_fanout", fanout)
+
+    texts = []
+
+    async def main():
+        await _admin()
+        await _run(outbox, handlers.compare_cmd, _update(100, [], texts),
+                   ["https://a.example/", "ios", "android"])
+        async with unit_of_work():
+            return await crud.get_global_stats(1)
+
+    stats = asyncio.run(main())
+    assert dict(stats["states"]) == {state: 2}
+    assert texts[-1].startswith("⚠️")
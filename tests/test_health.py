@@ -0,0 +1,82 @@
+# tests/test_health.py
+
+import pytest
+
+from crawler import health
+from crawler.health import ProxyHealth, MOSCOW
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(health.time, "time", c)
+    return c
+
+
+def _fill(h, hits, misses):
+    for _ in range(hits):
+        h.record(MOSCOW, 100)
+    for _ in range(misses):
+        h.record("Tver", 100)
+
+
+def test_plan_without_samples_uses_static_budget(clock):
+    assert ProxyHealth().plan() == (health.MAX_PROXY_ATTEMPTS, 1)
+
+
+def test_plan_grows_with_lower_hit_rate(clock):
+    good, bad = ProxyHealth(), ProxyHealth()
+    _fill(good, hits=9, misses=1)
+    _fill(bad, hits=2, misses=8)
+    good_budget, good_parallel = good.plan()
+    bad_budget, bad_parallel = bad.plan()
+    assert health.PROXY_MIN_ATTEMPTS <= good_budget < bad_budget <= health.PROXY_MAX_ATTEMPTS_CAP
+    assert 1 <= good_parallel <= bad_parallel <= health.PROXY_MAX_PARALLEL
+
+
+def test_old_samples_leave_the_window(clock):
+    h = ProxyHealth()
+    _fill(h, hits=0, misses=5)
+    clock.now += health.PROXY_HEALTH_WINDOW + 1
+    assert h.snapshot()["samples"] == 0
+
+
+def test_breaker_opens_then_half_open_trial(clock):
+    h = ProxyHealth()
+    _fill(h, hits=0, misses=health.PROXY_BREAKER_MIN_SAMPLES)
+    assert h.snapshot()["state"] == "open"
+    assert not h.allow()
+
+    clock.now += health.PROXY_BREAKER_COOLDOWN
+    assert h.snapshot()["state"] == "half-open"
+    assert h.allow()
+    # пока идёт пробный подбор, остальные ждут
+    assert not h.allow()
+
+
+def test_successful_trial_closes_breaker(clock):
+    h = ProxyHealth()
+    _fill(h, hits=0, misses=health.PROXY_BREAKER_MIN_SAMPLES)
+    clock.now += health.PROXY_BREAKER_COOLDOWN
+    assert h.allow()
+    h.finish(True)
+    assert h.snapshot()["state"] == "closed"
+    assert h.allow()
+
+
+def test_failed_trial_reopens_breaker(clock):
+    h = ProxyHealth()
+    _fill(h, hits=0, misses=health.PROXY_BREAKER_MIN_SAMPLES)
+    clock.now += health.PROXY_BREAKER_COOLDOWN
+    assert h.allow()
+    h.finish(False)
+    assert h.snapshot()["state"] == "open"
+    assert not h.allow()
@@ -0,0 +1,33 @@
+# tests/test_intern_url.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiosqlite")
+
+from db import crud
+from db.database import create_schema, unit_of_work
+
+
+def test_hash_collision_does_not_mix_up_urls(monkeypatch):
+    # все URL с одинаковым хэшем
+    monkeypatch.setattr(crud, "url_hash", lambda text: 42)
+    crud._url_cache.clear()
+
+    async def main():
+        await create_schema()
+        async with unit_of_work() as db:
+            a = await crud._intern_url(db, "https://a.example/")
+            b = await crud._intern_url(db, "https://b.example/")
+        # второй проход — уже из кэша после коммита
+        async with unit_of_work() as db:
+            assert await crud._intern_url(db, "https://a.example/") == a
+            assert await crud._intern_url(db, "https://b.example/") == b
+            # повторное интернирование не создаёт новую строку
+            assert await crud._intern_url(db, "HTTPS://A.example/") == a
+        return a, b
+
+    a, b = asyncio.run(main())
+    assert a != b
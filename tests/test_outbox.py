@@ -0,0 +1,90 @@
+# tests/test_outbox.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from bot.outbox import Outbox, TokenBucket, INTERACTIVE, BULK
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_token_bucket_respects_retry_after_pause():
+    bucket = TokenBucket(rate=10, capacity=5)
+    now = bucket.updated
+    bucket.blocked_until = now + 3
+    assert bucket.delay(now) == pytest.approx(3)
+
+
+def _sender(log, name):
+    async def send():
+        log.append(name)
+        return name
+    return send
+
+
+def test_priority_never_reorders_one_chat():
+    async def main():
+        box = Outbox()
+        log = []
+        box.submit(1, _sender(log, "bulk-1"), BULK)
+        box.submit(1, _sender(log, "interactive-1"), INTERACTIVE)
+        box.submit(2, _sender(log, "interactive-2"), INTERACTIVE)
+        await box.start()
+        await asyncio.sleep(0.05)
+        await box.stop()
+        return log
+
+    log = asyncio.run(main())
+    assert log.index("bulk-1") < log.index("interactive-1")
+
+
+def test_interactive_chat_goes_first():
+    async def main():
+        box = Outbox()
+        log = []
+        box.submit(1, _sender(log, "bulk"), BULK)
+        box.submit(2, _sender(log, "interactive"), INTERACTIVE)
+        await box.start()
+        await asyncio.sleep(0.05)
+        await box.stop()
+        return log
+
+    assert asyncio.run(main())[0] == "interactive"
+
+
+def test_coalesced_jobs_send_last_version():
+    async def main():
+        box = Outbox()
+        log = []
+        first = box.submit(1, _sender(log, "v1"), coalesce_key="msg")
+        second = box.submit(1, _sender(log, "v2"), coalesce_key="msg")
+        await box.start()
+        results = await asyncio.gather(first, second)
+        await box.stop()
+        return log, results
+
+    log, results = asyncio.run(main())
+    assert log == ["v2"]
+    assert results == ["v2", "v2"]
+
+
+def test_stop_cancels_pending_futures():
+    async def main():
+        box = Outbox()
+        # до start(): submit не падает, задание ждёт диспетчера
+        future = box.submit(1, _sender([], "never"))
+        await box.stop()
+        return future
+
+    future = asyncio.run(main())
+    assert future.cancelled()
@@ -0,0 +1,42 @@
+# tests/test_urls.py
+
+from db.urls import normalize_url, url_hash, url_host, LruCache
+
+
+def test_normalize_lowercases_scheme_and_host_only():
+    assert normalize_url("  HTTPS://Example.COM/Path?Q=A#Frag ") == "https://example.com/Path?Q=A#Frag"
+
+
+def test_normalize_keeps_unparseable_input():
+    assert normalize_url("http://[::1") == "http://[::1"
+
+
+def test_hash_is_stable_signed_64bit():
+    h = url_hash("https://example.com/")
+    assert h == url_hash("https://example.com/")
+    assert -2**63 <= h < 2**63
+    assert h != url_hash("https://example.com/a")
+
+
+def test_host_strips_www_and_port():
+    assert url_host("https://WWW.Example.com:8443/x") == "example.com"
+    assert url_host("") is None
+    assert url_host("not a url") is None
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LruCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1      # "a" теперь свежее "b"
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_clear():
+    cache = LruCache(2)
+    cache.put("a", 1)
+    cache.clear()
+    assert cache.get("a") is None
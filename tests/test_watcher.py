@@ -0,0 +1,94 @@
+# tests/test_watcher.py
+
+import datetime
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("seleniumwire")
+
+from bot.watcher import parse_windows, in_windows
+from crawler.redirector import _origins
+
+t = datetime.time
+
+
+def test_parse_windows():
+    assert parse_windows("") == []
+    assert parse_windows("01:00-07:00, 13:30-14:00") == [(t(1), t(7)), (t(13, 30), t(14))]
+
+
+def test_in_windows_plain_and_overnight():
+    windows = parse_windows("23:00-05:00,13:00-14:00")
+    assert in_windows(t(23, 30), windows)
+    assert in_windows(t(2), windows)
+    assert in_windows(t(13), windows)
+    assert not in_windows(t(14), windows)       # конец окна не включается
+    assert not in_windows(t(12), windows)
+
+
+def test_no_windows_means_always():
+    assert in_windows(t(12), [])
+
+
+def test_origins_of_redirect_chain():
+    assert _origins([
+        "https://a.example/x?y",
+        "https://A.example/other",
+        "http://user:pw@b.example:8080/",
+        "about:blank",
+        "",
+    ]) == ["https://a.example", "http://b.example:8080"]
+
+
+def test_session_acquires_proxy_outside_background_slot(fresh_db, monkeypatch):
+    import asyncio
+
+    from bot import watcher
+    from db import crud
+    from db.database import unit_of_work
+    from crawler.concurrency import CrawlController
+
+    controller = CrawlController()
+    monkeypatch.setattr(watcher, "crawl_controller", controller)
+
+    device = {"id": 1, "model": "Pixel"}
+
+    async def random_device(device_class=None):
+        return device
+    monkeypatch.setattr(watcher, "get_random_device", random_device)
+
+    active_during_acquire = []
+    proxy = ("http://u:p@proxy:1", {"query": "1.2.3.4", "isp": "ISP"})
+
+    def acquire():
+        active_during_acquire.append(controller.active)
+        return proxy, []
+    monkeypatch.setattr(watcher, "acquire_proxy", acquire)
+
+    class Engine:
+        async def fetch_many(self, raw_urls, device, *, proxy=None):
+            assert controller.active == 1
+            self.proxy = proxy
+            stats = {"duration_ms": 10, "chrome_peak_rss_kb": None,
+                     "backend_peak_rss_kb": None, "hops": []}
+            return "1.2.3.4", "ISP", [], [(u, "https://b.example/", stats) for u in raw_urls]
+    engine = Engine()
+    monkeypatch.setattr(watcher, "crawl_engine", engine)
+
+    async def main():
+        async with unit_of_work():
+            user = await crud.invite_user("watcher", "User", None)
+            await crud.activate_user(200, "watcher")
+            await crud.add_watch(user.id, "https://a.example/", 60, None)
+        async with unit_of_work():
+            due = await crud.list_due_watches(datetime.datetime.utcnow(), 10)
+        await watcher.WatchScheduler()._check_session(None, due)
+        async with unit_of_work():
+            return await crud.get_global_stats(1)
+
+    stats = asyncio.run(main())
+    assert active_during_acquire == [0]
+    assert engine.proxy == proxy
+    assert dict(stats["states"]) == {"watch": 1}